@@ -0,0 +1,87 @@
+"""
+Compare event throughput of the simpy, heap and calendar queue event cores
+Runs the v3 protocol and heartbeat timer storms on each backend and reports events/sec
+"""
+import hashlib
+import json
+import subprocess
+import sys
+import time
+
+NODE_COUNT = 300
+DURATION = 2000
+BACKENDS = ['simpy', 'heap', 'calendar']
+
+TIMER_NODES = [1000, 10000]
+TIMER_DURATION = 500
+TIMER_INTERVAL = 10  # HEARTH_BEAT_TIME_INTERVAL
+
+# Runs one workload in a fresh interpreter, so module level state of the protocol is not shared between runs
+CHILD = r'''
+import hashlib, json, runpy, sys, time
+sys.path.insert(1, '.')
+from source import config
+workload, backend, node_count, duration, interval = sys.argv[1:6]
+config.SIM_VISUALIZATION = False
+config.SIM_TIME_SCALE = 0
+config.SIM_EVENT_BACKEND = backend
+config.SIM_NODE_COUNT = int(node_count)
+config.SIM_DURATION = float(duration)
+
+if workload == 'v3':
+    start = time.time()
+    g = runpy.run_path('data_collection_tree_v3.py', run_name='__main__')
+    wall = time.time() - start
+    sim = g['sim']
+    digest = hashlib.md5(open('simulation_log.txt', 'rb').read()).hexdigest()
+else:
+    from source import wsnlab as wsn
+
+    class TimerNode(wsn.Node):
+        def init(self):
+            self.beats = 0
+            self.set_timer('TIMER_HEART_BEAT', self.sim.random.uniform(0, float(interval)))
+
+        def on_timer_fired(self, name, *args, **kwargs):
+            self.beats += 1
+            self.set_timer('TIMER_HEART_BEAT', float(interval))
+
+    sim = wsn.Simulator(config.SIM_DURATION, timescale=0)
+    sim.add_nodes(TimerNode, [(i, 0) for i in range(config.SIM_NODE_COUNT)], tx_range=0)
+    start = time.time()
+    sim.run()
+    wall = time.time() - start
+    digest = hashlib.md5(str([n.beats for n in sim.nodes]).encode()).hexdigest()
+events = getattr(sim.env, 'event_count', None)
+if events is None:
+    # simpy: every scheduled event took an id, the ones left in its queue were not processed
+    events = next(sim.env._eid) - len(sim.env._queue)
+sys.__stdout__.write('RESULT ' + json.dumps({'wall': wall, 'events': events, 'digest': digest}) + '\n')
+'''
+
+
+def run(workload, backend, node_count, duration, interval=0):
+    out = subprocess.run([sys.executable, '-c', CHILD, workload, backend, str(node_count), str(duration), str(interval)],
+                         capture_output=True, text=True, check=True).stdout
+    line = [l for l in out.splitlines() if l.startswith('RESULT ')][-1]
+    return json.loads(line[len('RESULT '):])
+
+
+def compare(title, workload, node_count, duration, interval=0):
+    print(f"\n{title}: {node_count} nodes, {duration}s")
+    print('-' * 70)
+    results = {b: run(workload, b, node_count, duration, interval) for b in BACKENDS}
+    for backend in BACKENDS:
+        r = results[backend]
+        speedup = results['simpy']['wall'] / r['wall']
+        print(f"  {backend:8s} {r['wall']:8.2f}s  {r['events']:10,d} events  {r['events'] / r['wall']:12,.0f} events/s  x{speedup:.2f}")
+    same = len({r['digest'] for r in results.values()}) == 1
+    print(f"  Results identical across backends: {same}")
+
+
+print("=" * 70)
+print("Event Core Throughput Comparison")
+print("=" * 70)
+compare("v3 protocol", 'v3', NODE_COUNT, DURATION)
+for count in TIMER_NODES:
+    compare(f"Heartbeat storm (every {TIMER_INTERVAL}s)", 'timers', count, TIMER_DURATION, TIMER_INTERVAL)
@@ -708,7 +708,7 @@ class SensorNode(wsn.Node):
                 self.neighbor_last_seen[pck['gui']] = self.now
         
         if self.role in [Roles.ROOT, Roles.CLUSTER_HEAD, Roles.ROUTER]:
-            if 'next_hop' in pck.keys() and pck['dest'] != self.addr:
+            if 'next_hop' in pck and pck['dest'] != self.addr:
                 if self.role == Roles.ROUTER or pck['dest'] != self.ch_addr:
                     self.route_and_forward_package(pck)
                     return
@@ -1732,17 +1732,23 @@ def create_network(node_class, number_of_nodes=100):
     edge = math.ceil(math.sqrt(number_of_nodes))
     startup_delay = getattr(config, 'NODE_STARTUP_DELAY', 5)
     
+    positions = []
+    arrivals = []
     for i in range(number_of_nodes):
         x = i / edge
         y = i % edge
         px = 300 + config.SCALE*x * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
         py = 200 + config.SCALE* y * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
-        node = sim.add_node(node_class, (px, py))
-        NODE_POS[node.id] = (px, py)
-        node.tx_range = config.NODE_TX_RANGE * config.SCALE
-        node.logging = True
+        positions.append((px, py))
         # All nodes appear immediately (white), then wake up together after startup_delay
-        node.arrival = startup_delay + random.uniform(0, 2)  # Small variance to prevent exact simultaneity
+        arrivals.append(startup_delay + random.uniform(0, 2))  # Small variance to prevent exact simultaneity
+    
+    # Bulk creation: neighbor lists of all nodes are built at once
+    nodes = sim.add_nodes(node_class, positions, tx_range=config.NODE_TX_RANGE * config.SCALE)
+    for node, arrival in zip(nodes, arrivals):
+        NODE_POS[node.id] = node.pos
+        node.logging = True
+        node.arrival = arrival
         if node.id == ROOT_ID:
             node.arrival = startup_delay  # Root starts first
 
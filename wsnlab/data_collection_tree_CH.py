@@ -38,6 +38,41 @@ SLEEP_ENERGY_PER_SECOND = getattr(config, 'SLEEP_ENERGY_PER_SECOND', 0.000001)
 ENABLE_PACKET_LOSS = getattr(config, 'ENABLE_PACKET_LOSS', False)
 PACKET_LOSS_PROBABILITY = getattr(config, 'PACKET_LOSS_PROBABILITY', 0.1)
 ENERGY_SAMPLE_INTERVAL = getattr(config, 'ENERGY_SAMPLE_INTERVAL', 100)
+LIFETIME_DEAD_PERCENTS = getattr(config, 'LIFETIME_DEAD_PERCENTS', (10, 50))
+ENABLE_LIFETIME_MODE = getattr(config, 'ENABLE_LIFETIME_MODE', False)
+LIFETIME_STOP = getattr(config, 'LIFETIME_STOP', 'first_death')
+ENABLE_FAST_FORWARD = getattr(config, 'ENABLE_FAST_FORWARD', False)
+FAST_FORWARD_WINDOW = getattr(config, 'FAST_FORWARD_WINDOW', 1000)
+FAST_FORWARD_TOLERANCE = getattr(config, 'FAST_FORWARD_TOLERANCE', 0.1)
+FAST_FORWARD_GUARD = getattr(config, 'FAST_FORWARD_GUARD', 2000)
+
+# Payload bytes per message type, added to the header in calculate_packet_size()
+PACKET_PAYLOAD_SIZES = {
+    'PROBE': 20, 'HEART_BEAT': 20,
+    'JOIN_REQUEST': 30, 'JOIN_REPLY': 30, 'JOIN_ACK': 30,
+    'NETWORK_REQUEST': 40, 'NETWORK_REPLY': 40,
+}
+
+
+def calculate_packet_size(packet):
+    """Calculate packet size in bytes for energy consumption (cached on the packet)"""
+    size = packet.nbytes
+    if size is None:
+        # Base packet overhead
+        size = 50  # bytes (headers, etc.)
+        
+        # Add payload based on packet type
+        if packet.kind == 'DATA':
+            size += packet.get('size', 100)
+        else:
+            size += PACKET_PAYLOAD_SIZES.get(packet.kind, 25)
+        packet.nbytes = size
+    return size
+
+
+# Radio energy accountant of all nodes, attached to the simulator when energy model is enabled
+RADIO = wsn.RadioEnergy(TX_ENERGY_PER_BYTE, RX_ENERGY_PER_BYTE, IDLE_ENERGY_PER_SECOND, SLEEP_ENERGY_PER_SECOND,
+                        250000, calculate_packet_size)  # data rate in bytes/s for radio airtime
 
 ###########################################################
 class SensorNode(wsn.Node):
@@ -81,29 +116,11 @@ class SensorNode(wsn.Node):
         
         # Energy Model
         if ENABLE_ENERGY_MODEL:
+            # Time and energy per radio state, packets and bytes are counted by RADIO
             self.initial_energy = INITIAL_ENERGY_JOULES
-            self.remaining_energy = INITIAL_ENERGY_JOULES
             self.is_alive = True
-            
-            # Time tracking per state
-            self.time_in_tx = 0.0
-            self.time_in_rx = 0.0
-            self.time_in_idle = 0.0
-            self.time_in_sleep = 0.0
-            self.last_energy_update = 0.0
-            
-            # Energy consumption by source
-            self.energy_tx = 0.0
-            self.energy_rx = 0.0
-            self.energy_idle = 0.0
-            self.energy_sleep = 0.0
-            
-            # Packet statistics
-            self.packets_sent = 0
-            self.packets_received = 0
+            self.death_time = None
             self.packets_lost = 0
-            self.bytes_sent = 0
-            self.bytes_received = 0
         
         # Join time tracking
         self.wakeup_time = None      # When node became UNREGISTERED
@@ -131,7 +148,10 @@ class SensorNode(wsn.Node):
             if ROLE_COUNTS[old_role] <= 0:
                 ROLE_COUNTS.pop(old_role, None)
         ROLE_COUNTS[new_role] += 1
+        self.sim.update_role_index(self, old_role, new_role)
         self.role = new_role
+        if new_role == Roles.ROOT and self.sim.lifetime is not None:
+            self.sim.lifetime.set_root(self.id)
         
         # Track wakeup time (when node becomes UNREGISTERED)
         if new_role == Roles.UNREGISTERED and self.wakeup_time is None:
@@ -167,123 +187,57 @@ class SensorNode(wsn.Node):
     # Energy Model Methods
     ###################
     
-    def calculate_packet_size(self, packet):
-        """Calculate packet size in bytes for energy consumption"""
-        if not ENABLE_ENERGY_MODEL:
-            return 0
-        
-        # Base packet overhead
-        size = 50  # bytes (headers, etc.)
-        
-        # Add payload based on packet type
-        if isinstance(packet, dict):
-            pck_type = packet.get('type', '')
-            if pck_type in ['PROBE', 'HEART_BEAT']:
-                size += 20
-            elif pck_type in ['JOIN_REQUEST', 'JOIN_REPLY', 'JOIN_ACK']:
-                size += 30
-            elif pck_type in ['NETWORK_REQUEST', 'NETWORK_REPLY']:
-                size += 40
-            elif pck_type == 'DATA':
-                size += packet.get('size', 100)
-            else:
-                size += 25
-        
-        return size
-    
-    def consume_energy(self, amount, source):
-        """Consume energy and track by source (TX/RX/IDLE/SLEEP)"""
-        if not ENABLE_ENERGY_MODEL or not hasattr(self, 'is_alive') or not self.is_alive:
-            return
-        
-        self.remaining_energy -= amount
-        
-        # Track by source
-        if source == 'TX':
-            self.energy_tx += amount
-        elif source == 'RX':
-            self.energy_rx += amount
-        elif source == 'IDLE':
-            self.energy_idle += amount
-        elif source == 'SLEEP':
-            self.energy_sleep += amount
-        
-        # Check if node died
-        if self.remaining_energy <= 0:
-            self.remaining_energy = 0
+    @property
+    def remaining_energy(self):
+        """Remaining energy of node, integrated by RADIO up to now"""
+        if not self.is_alive:
+            return 0.0
+        return max(self.initial_energy - RADIO.consumed(self.id, self.now), 0.0)
+
+    def check_energy(self):
+        """Kill node if its energy is depleted"""
+        if self.is_alive and self.remaining_energy <= 0:
             self.die_from_energy_depletion()
-    
+
     def die_from_energy_depletion(self):
         """Handle node death from energy depletion"""
         if not hasattr(self, 'is_alive') or not self.is_alive:
             return
         
+        RADIO.transition(self.id, wsn.RADIO_OFF, self.now)
         self.is_alive = False
+        self.death_time = self.sim.elapsed
         self.log(f"[ENERGY] Node {self.id} DIED - Energy depleted!")
         
         # Become undiscovered
         self.set_role(Roles.UNDISCOVERED)
         self.kill_all_timers()
-    
-    def update_idle_energy(self):
-        """Update idle/sleep energy consumption based on time elapsed"""
-        if not ENABLE_ENERGY_MODEL or not hasattr(self, 'is_alive') or not self.is_alive:
-            return
-        
-        if not hasattr(self, 'last_energy_update') or self.last_energy_update == 0:
-            self.last_energy_update = self.now
-            return
         
-        time_elapsed = self.now - self.last_energy_update
-        self.last_energy_update = self.now
-        
-        if time_elapsed <= 0:
-            return
-        
-        # Calculate energy based on current role
-        if self.role == Roles.UNDISCOVERED:
-            # Sleeping
-            energy = time_elapsed * SLEEP_ENERGY_PER_SECOND
-            self.consume_energy(energy, 'SLEEP')
-            self.time_in_sleep += time_elapsed
-        else:
-            # Idle (listening)
-            energy = time_elapsed * IDLE_ENERGY_PER_SECOND
-            self.consume_energy(energy, 'IDLE')
-            self.time_in_idle += time_elapsed
+        # Lifetime metrics, may stop the simulation
+        if self.sim.lifetime is not None:
+            self.sim.lifetime.node_died(self.id)
 
     ###################
     # Override send() to track TX energy
     ###################
     
     def send(self, pck):
-        """Override send to track TX energy consumption"""
+        """Override send to drop packets of dead nodes and lost packets, TX energy is counted by RADIO"""
+        pck = wsn.as_packet(pck)
         # Check if node is alive
         if ENABLE_ENERGY_MODEL and hasattr(self, 'is_alive') and not self.is_alive:
             return  # Dead nodes can't send
         
-        # Update idle energy before TX
-        if ENABLE_ENERGY_MODEL:
-            self.update_idle_energy()
-        
         # Check packet loss
         if ENABLE_PACKET_LOSS and hasattr(self, 'packets_lost'):
             if random.random() < PACKET_LOSS_PROBABILITY:
                 self.packets_lost += 1
                 return  # Packet lost
         
-        # Calculate TX energy
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'bytes_sent'):
-            packet_size = self.calculate_packet_size(pck)
-            tx_energy = packet_size * TX_ENERGY_PER_BYTE
-            self.consume_energy(tx_energy, 'TX')
-            self.bytes_sent += packet_size
-            self.packets_sent += 1
-            tx_time = packet_size / 250000  # 250 kbps data rate
-            self.time_in_tx += tx_time
-        
         # Call parent send
         super().send(pck)
+        if ENABLE_ENERGY_MODEL:
+            self.check_energy()
 
     
     def become_unregistered(self):
@@ -474,26 +428,16 @@ class SensorNode(wsn.Node):
         Returns:
 
         """
-        # Energy Model: Check if node is alive
+        # Energy Model: Check if node is alive, RX energy is counted by RADIO
         if ENABLE_ENERGY_MODEL and hasattr(self, 'is_alive') and not self.is_alive:
             return  # Dead nodes can't receive
-        
-        # Energy Model: Update idle energy before RX
         if ENABLE_ENERGY_MODEL:
-            self.update_idle_energy()
-        
-        # Energy Model: Calculate RX energy
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'bytes_received'):
-            packet_size = self.calculate_packet_size(pck)
-            rx_energy = packet_size * RX_ENERGY_PER_BYTE
-            self.consume_energy(rx_energy, 'RX')
-            self.bytes_received += packet_size
-            self.packets_received += 1
-            rx_time = packet_size / 250000  # 250 kbps data rate
-            self.time_in_rx += rx_time
+            self.check_energy()
+            if not self.is_alive:
+                return
         
         if self.role == Roles.ROOT or self.role == Roles.CLUSTER_HEAD:  # if the node is root or cluster head
-            if 'next_hop' in pck.keys() and pck['dest'] != self.addr and pck['dest'] != self.ch_addr:  # forwards message if destination is not itself
+            if 'next_hop' in pck and pck['dest'] != self.addr and pck['dest'] != self.ch_addr:  # forwards message if destination is not itself
                 self.route_and_forward_package(pck)
                 return
             if pck['type'] == 'HEART_BEAT':
@@ -645,27 +589,27 @@ class SensorNode(wsn.Node):
         if not ENABLE_ENERGY_MODEL:
             return
         
+        energies = RADIO.energies(self.now)
         for node in sim.nodes:
-            if hasattr(node, 'remaining_energy'):
-                # Update idle energy before sampling
-                node.update_idle_energy()
-                
+            if hasattr(node, 'initial_energy'):
+                i = node.id
+                remaining = node.remaining_energy
                 sample = {
-                    'timestamp': self.now,
-                    'node_id': node.id,
+                    'timestamp': self.sim.elapsed,
+                    'node_id': i,
                     'role': node.role.name if hasattr(node, 'role') else 'UNKNOWN',
-                    'remaining_energy': node.remaining_energy,
-                    'energy_consumed': node.initial_energy - node.remaining_energy,
-                    'energy_tx': node.energy_tx,
-                    'energy_rx': node.energy_rx,
-                    'energy_idle': node.energy_idle,
-                    'energy_sleep': node.energy_sleep,
+                    'remaining_energy': remaining,
+                    'energy_consumed': node.initial_energy - remaining,
+                    'energy_tx': energies[i, wsn.RADIO_TX],
+                    'energy_rx': energies[i, wsn.RADIO_RX],
+                    'energy_idle': energies[i, wsn.RADIO_IDLE],
+                    'energy_sleep': energies[i, wsn.RADIO_SLEEP],
                     'is_alive': node.is_alive,
-                    'packets_sent': node.packets_sent,
-                    'packets_received': node.packets_received,
+                    'packets_sent': RADIO.packets_sent[i],
+                    'packets_received': RADIO.packets_received[i],
                     'packets_lost': node.packets_lost,
-                    'bytes_sent': node.bytes_sent,
-                    'bytes_received': node.bytes_received
+                    'bytes_sent': RADIO.bytes_sent[i],
+                    'bytes_received': RADIO.bytes_received[i]
                 }
                 ENERGY_SAMPLES.append(sample)
 
@@ -837,39 +781,56 @@ def write_energy_summary_csv(path="energy_summary_CH.csv"):
             "bytes_sent", "bytes_received", "is_alive", "death_time"
         ])
         
+        times = RADIO.times(sim.now)
+        energies = times * RADIO.power
         for node in sim.nodes:
-            if hasattr(node, 'remaining_energy'):
-                # Update final idle energy
-                node.update_idle_energy()
-                
-                death_time = ''
-                if hasattr(node, 'is_alive') and not node.is_alive:
-                    death_time = node.now
+            if hasattr(node, 'initial_energy'):
+                i = node.id
+                death_time = node.death_time if node.death_time is not None else ''
+                remaining = node.remaining_energy
                 
                 w.writerow([
-                    node.id,
+                    i,
                     node.role.name if hasattr(node, 'role') else 'UNKNOWN',
                     node.initial_energy,
-                    node.remaining_energy,
-                    node.initial_energy - node.remaining_energy,
-                    node.energy_tx,
-                    node.energy_rx,
-                    node.energy_idle,
-                    node.energy_sleep,
-                    node.time_in_tx,
-                    node.time_in_rx,
-                    node.time_in_idle,
-                    node.time_in_sleep,
-                    node.packets_sent,
-                    node.packets_received,
+                    remaining,
+                    node.initial_energy - remaining,
+                    energies[i, wsn.RADIO_TX],
+                    energies[i, wsn.RADIO_RX],
+                    energies[i, wsn.RADIO_IDLE],
+                    energies[i, wsn.RADIO_SLEEP],
+                    times[i, wsn.RADIO_TX],
+                    times[i, wsn.RADIO_RX],
+                    times[i, wsn.RADIO_IDLE],
+                    times[i, wsn.RADIO_SLEEP],
+                    RADIO.packets_sent[i],
+                    RADIO.packets_received[i],
                     node.packets_lost,
-                    node.bytes_sent,
-                    node.bytes_received,
+                    RADIO.bytes_sent[i],
+                    RADIO.bytes_received[i],
                     node.is_alive,
                     death_time
                 ])
 
 
+def write_network_lifetime_csv(path="network_lifetime_CH.csv"):
+    """Export time each network lifetime metric is reached at (empty if it is not reached)"""
+    if not ENABLE_ENERGY_MODEL:
+        return
+    
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["metric", "time", "stopped_simulation"])
+        for name, reached_at in sim.lifetime.times.items():
+            w.writerow([name, '' if reached_at is None else reached_at,
+                        reached_at is not None and name == sim.lifetime.stop])
+
+
+def remaining_energies(now):
+    """Remaining energy of all nodes (fast forward), 0 for dead nodes"""
+    return [node.remaining_energy for node in sim.nodes]
+
+
 def write_join_times_csv(path="join_times_CH.csv"):
     """Export join time data for each node"""
     with open(path, "w", newline="") as f:
@@ -906,16 +867,20 @@ def create_network(node_class, number_of_nodes=100):
 
     """
     edge = math.ceil(math.sqrt(number_of_nodes))
+    positions = []
+    arrivals = []
     for i in range(number_of_nodes):
         x = i / edge
         y = i % edge
         px = 300 + config.SCALE*x * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
         py = 200 + config.SCALE* y * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
-        node = sim.add_node(node_class, (px, py))
-        NODE_POS[node.id] = (px, py)   # <— add this line
-        node.tx_range = config.NODE_TX_RANGE * config.SCALE
+        positions.append((px, py))
+        arrivals.append(random.uniform(0, config.NODE_ARRIVAL_MAX))
+    nodes = sim.add_nodes(node_class, positions, tx_range=config.NODE_TX_RANGE * config.SCALE)
+    for node, arrival in zip(nodes, arrivals):
+        NODE_POS[node.id] = node.pos
         node.logging = True
-        node.arrival = random.uniform(0, config.NODE_ARRIVAL_MAX)
+        node.arrival = arrival
         if node.id == ROOT_ID:
             node.arrival = 0.1
 
@@ -927,6 +892,13 @@ sim = wsn.Simulator(
     terrain_size=config.SIM_TERRAIN_SIZE,
     title=config.SIM_TITLE)
 
+if ENABLE_ENERGY_MODEL:
+    sim.radio = RADIO  # nodes report radio states and TX/RX to the energy accountant
+    sim.lifetime = wsn.LifetimeMonitor(sim, LIFETIME_DEAD_PERCENTS, LIFETIME_STOP if ENABLE_LIFETIME_MODE else None)
+    if ENABLE_FAST_FORWARD:
+        sim.fast_forward = wsn.FastForward(sim, FAST_FORWARD_WINDOW, FAST_FORWARD_TOLERANCE, FAST_FORWARD_GUARD,
+                                           remaining_energies)
+
 # creating random network
 create_network(SensorNode, config.SIM_NODE_COUNT)
 
@@ -958,8 +930,10 @@ if join_times:
 if ENABLE_ENERGY_MODEL:
     write_energy_timeline_csv("energy_timeline_CH.csv")
     write_energy_summary_csv("energy_summary_CH.csv")
+    write_network_lifetime_csv("network_lifetime_CH.csv")
     print("Exported: energy_timeline_CH.csv")
     print("Exported: energy_summary_CH.csv")
+    print("Exported: network_lifetime_CH.csv")
     
     # Print energy statistics
     alive_nodes = sum(1 for node in sim.nodes if hasattr(node, 'is_alive') and node.is_alive)
@@ -967,6 +941,11 @@ if ENABLE_ENERGY_MODEL:
     print(f"\nEnergy Statistics:")
     print(f"  Alive nodes: {alive_nodes}/{total_nodes} ({alive_nodes/total_nodes*100:.1f}%)")
     print(f"  Energy samples collected: {len(ENERGY_SAMPLES)}")
+    if ENABLE_FAST_FORWARD:
+        print(f"  Fast forwarded: {sim.fast_forwarded:.2f}s in {len(sim.fast_forward.jumps)} skips")
+    print(f"  Network lifetime:")
+    for name, reached_at in sim.lifetime.times.items():
+        print(f"    {name}: {'not reached' if reached_at is None else f'{reached_at:.2f}s'}")
 
 
 # Created 100 nodes at random locations with random arrival times.
@@ -1,6 +1,8 @@
 import random
 from enum import Enum
 import sys
+import itertools
+import heapq
 sys.path.insert(1, '.')
 from source import wsnlab_vis as wsn
 import math
@@ -9,6 +11,7 @@ from collections import Counter
 import signal
 import atexit
 import csv
+import os
 import numpy as np
 
 NETWORK_SEED = 42
@@ -21,9 +24,6 @@ NODE_POS = {}  # {node_id: (x, y)}
 # Role tracking
 ROLE_COUNTS = Counter()  # live tally per Roles enum
 
-# Energy tracking (global list for CSV export)
-ENERGY_SAMPLES = []  # Stores energy samples over time
-
 
 Roles = Enum('Roles', 'UNDISCOVERED UNREGISTERED ROOT REGISTERED CLUSTER_HEAD ROUTER')
 """Enumeration of roles"""
@@ -56,9 +56,522 @@ SLEEP_ENERGY_PER_SECOND = getattr(config, 'SLEEP_ENERGY_PER_SECOND', 0.000001)
 ENABLE_PACKET_LOSS = getattr(config, 'ENABLE_PACKET_LOSS', False)
 PACKET_LOSS_PROBABILITY = getattr(config, 'PACKET_LOSS_PROBABILITY', 0.1)
 ENERGY_SAMPLE_INTERVAL = getattr(config, 'ENERGY_SAMPLE_INTERVAL', 100)
+ENERGY_TIMELINE_CHUNK_ROWS = getattr(config, 'ENERGY_TIMELINE_CHUNK_ROWS', 65536)
+ENERGY_TIMELINE_SPILL_DIR = getattr(config, 'ENERGY_TIMELINE_SPILL_DIR', None)
+LIFETIME_DEAD_PERCENTS = getattr(config, 'LIFETIME_DEAD_PERCENTS', (10, 50))
+ENABLE_LIFETIME_MODE = getattr(config, 'ENABLE_LIFETIME_MODE', False)
+LIFETIME_STOP = getattr(config, 'LIFETIME_STOP', 'first_death')
+ENABLE_FAST_FORWARD = getattr(config, 'ENABLE_FAST_FORWARD', False)
+FAST_FORWARD_WINDOW = getattr(config, 'FAST_FORWARD_WINDOW', 1000)
+FAST_FORWARD_TOLERANCE = getattr(config, 'FAST_FORWARD_TOLERANCE', 0.1)
+FAST_FORWARD_GUARD = getattr(config, 'FAST_FORWARD_GUARD', 2000)
+
+# Payload bytes per message type, added to the header in calculate_packet_size()
+PACKET_PAYLOAD_SIZES = {
+    'HEART_BEAT': 50,  # Position, role, hop count, network info
+    'JOIN_REQUEST': 35, 'JOIN_REPLY': 35, 'JOIN_ACK': 35,
+    'NETWORK_REQUEST': 40, 'NETWORK_REPLY': 40,
+    'BECOME_CH': 45,
+    'ROUTER_NOMINATION': 30,
+    'NEIGHBOR_SHARE': 60,  # Neighbor table data
+}
+
+
+###########################################################
+class InvariantChecker:
+    """Incremental checker of network invariants used by maintenance.
+    Each invariant is a predicate which is True when a node violates it. Predicates are re-evaluated only on
+    nodes marked dirty by role, parent and router bridge changes, and the nodes depending on them.
+
+    Attributes:
+        invariants (Dict): predicate per invariant name
+        violations (Dict): set of violating nodes per invariant name
+        dirty (Set): nodes to re-evaluate before violations are read
+        children (Dict): nodes per parent gui, so children are re-evaluated when their parent changes role
+        bridges (Dict): routers per bridged child CH gui, so routers are re-evaluated when the child changes role
+    """
+
+    def __init__(self):
+        self.invariants = {}
+        self.violations = {}
+        self.dirty = set()
+        self.children = {}
+        self.bridges = {}
+
+    def register(self, name, predicate):
+        """Register an invariant given as predicate(node) -> True if node violates it"""
+        self.invariants[name] = predicate
+        self.violations[name] = set()
+
+    def role_changed(self, node):
+        """Node changed role: re-check it, its children and the routers bridging to it"""
+        self.dirty.add(node)
+        self.dirty.update(self.children.get(node.id, ()))
+        self.dirty.update(self.bridges.get(node.id, ()))
+
+    def parent_changed(self, node, old_parent, new_parent):
+        """Node changed parent_gui: move it in children index and re-check it"""
+        self._move(self.children, node, old_parent, new_parent)
+        self.dirty.add(node)
+
+    def bridge_changed(self, node, old_child, new_child):
+        """Router changed its bridged child CH: move it in bridges index and re-check it"""
+        self._move(self.bridges, node, old_child, new_child)
+        self.dirty.add(node)
+
+    @staticmethod
+    def _move(index, node, old_key, new_key):
+        if old_key is not None and old_key in index:
+            index[old_key].discard(node)
+            if not index[old_key]:
+                del index[old_key]
+        if new_key is not None:
+            index.setdefault(new_key, set()).add(node)
+
+    def flush(self):
+        """Re-evaluate invariants on dirty nodes only"""
+        for node in self.dirty:
+            for name, predicate in self.invariants.items():
+                if predicate(node):
+                    self.violations[name].add(node)
+                else:
+                    self.violations[name].discard(node)
+        self.dirty.clear()
+
+    def violating(self, name):
+        """Nodes violating an invariant, sorted by id"""
+        self.flush()
+        return sorted(self.violations[name])
+
+
+def _parent_of(node):
+    return sim.get_node(node.parent_gui) if node.parent_gui is not None else None
+
 
+def green_without_parent(node):
+    """REGISTERED node outside network (no parent CH)"""
+    return getattr(node, 'role', None) == Roles.REGISTERED and node.parent_gui is None
 
 
+def green_under_router(node):
+    """REGISTERED node whose parent_gui is a ROUTER"""
+    return getattr(node, 'role', None) == Roles.REGISTERED and getattr(_parent_of(node), 'role', None) == Roles.ROUTER
+
+
+def green_under_green(node):
+    """REGISTERED node whose parent is another REGISTERED node"""
+    return getattr(node, 'role', None) == Roles.REGISTERED and getattr(_parent_of(node), 'role', None) == Roles.REGISTERED
+
+
+def orphaned_router(node):
+    """ROUTER which is not bridging to a child CH"""
+    if getattr(node, 'role', None) != Roles.ROUTER:
+        return False
+    if len(node.connected_CHs) > 1:
+        child = sim.get_node(node.connected_CHs[1])
+        return getattr(child, 'role', None) not in [Roles.CLUSTER_HEAD, Roles.ROOT]
+    return True
+
+
+INVARIANTS = InvariantChecker()
+INVARIANTS.register('green_without_parent', green_without_parent)
+INVARIANTS.register('green_under_router', green_under_router)
+INVARIANTS.register('green_under_green', green_under_green)
+INVARIANTS.register('orphaned_router', orphaned_router)
+
+
+###########################################################
+class IndexedTable(dict):
+    """Dict which keeps a reverse index from keys found in its values to its own keys, so routing can map a
+    destination to a table entry with a dict lookup instead of scanning the table.
+    Values must be replaced (not mutated in place) for the index to see the change.
+
+    Attributes:
+        index_keys (Function): gives the index keys of a value
+        on_change (Function): called as on_change(key, old_value, new_value) after a change, None for a missing side
+        index (Dict): set of table keys per index key
+        order (Dict): insertion sequence per table key, same order as dict iteration
+    """
+    __slots__ = ('index_keys', 'on_change', 'index', 'order', '_seq')
+
+    def __init__(self, index_keys, on_change=None):
+        super().__init__()
+        self.index_keys = index_keys
+        self.on_change = on_change
+        self.index = {}
+        self.order = {}
+        self._seq = itertools.count()
+
+    def __setitem__(self, key, value):
+        old = None
+        if key in self:
+            old = dict.__getitem__(self, key)
+            self._unindex(key, old)
+        else:
+            self.order[key] = next(self._seq)
+        dict.__setitem__(self, key, value)
+        for index_key in self.index_keys(value):
+            self.index.setdefault(index_key, set()).add(key)
+        if self.on_change is not None:
+            self.on_change(key, old, value)
+
+    def __delitem__(self, key):
+        old = dict.__getitem__(self, key)
+        self._unindex(key, old)
+        del self.order[key]
+        dict.__delitem__(self, key)
+        if self.on_change is not None:
+            self.on_change(key, old, None)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def _unindex(self, key, value):
+        for index_key in self.index_keys(value):
+            keys = self.index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.index[index_key]
+
+    def lookup(self, index_key):
+        """Table keys whose value has index_key, in table order"""
+        keys = self.index.get(index_key)
+        if not keys:
+            return []
+        return sorted(keys, key=self.order.__getitem__)
+
+
+def addr_index_keys(info):
+    """Index multihop_neighbors entries by their 'addr'"""
+    addr = info.get('addr')
+    return () if addr is None else (addr,)
+
+
+def neighbor_index_keys(entry):
+    """Index neighbors_table entries by their addr"""
+    return () if entry.addr is None else (entry.addr,)
+
+
+def networks_index_keys(networks):
+    """Index child_networks_table entries by each child network"""
+    return networks
+
+
+###########################################################
+class NeighborEntry:
+    """What a node keeps from a neighbor's heart beat message.
+
+    Attributes:
+        role (Roles): role of neighbor
+        addr (Addr): address of neighbor
+        ch_addr (Addr): cluster head address of neighbor, None if it is not a cluster head
+        source (Addr): source address of heart beat, used to send join requests
+        hop_count (int): hop count of neighbor
+        distance (float): distance to neighbor, None if positions are unknown
+        cluster_size (int): cluster size of neighbor, None if it is not a cluster head
+        root_addr (Addr): root address, if the heart beat carries it
+        last_seen (float): arrival time of heart beat
+    """
+    __slots__ = ('role', 'addr', 'ch_addr', 'source', 'hop_count', 'distance', 'cluster_size', 'root_addr', 'last_seen')
+
+    def __init__(self, pck, distance, last_seen):
+        self.role = pck.get('role')
+        self.addr = pck.get('addr')
+        self.ch_addr = pck.get('ch_addr')
+        self.source = pck.get('source')
+        self.hop_count = pck.get('hop_count')
+        self.distance = distance
+        self.cluster_size = pck.get('cluster_size')
+        self.root_addr = pck.get('root_addr')
+        self.last_seen = last_seen
+
+
+###########################################################
+class ExpiryHeap:
+    """Min-heap of (timestamp, key) used for aging table entries. Refreshing an entry pushes a new
+    timestamp and leaves the old one in the heap; an old one is dropped when it reaches the top
+    (lazy deletion), so aging only touches entries which are older than the timeout.
+
+    Attributes:
+        heap (List): (timestamp, key) entries, oldest first
+    """
+    __slots__ = ('heap',)
+
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, timestamp, key):
+        heapq.heappush(self.heap, (timestamp, key))
+
+    def pop_expired(self, now, timeout, current):
+        """Pops keys whose timestamp is older than timeout.
+
+        Args:
+            now (float): current time
+            timeout (float): age after which an entry expires
+            current (Function): gives the live timestamp of a key, entries with another timestamp are dropped
+
+        Returns:
+            List: expired keys, oldest first
+        """
+        expired = []
+        heap = self.heap
+        last = None
+        while heap and now - heap[0][0] > timeout:
+            entry = heapq.heappop(heap)
+            # equal entries pop one after another, only the first one counts
+            if entry != last and current(entry[1]) == entry[0]:
+                expired.append(entry[1])
+            last = entry
+        return expired
+
+
+###########################################################
+def calculate_packet_size(packet):
+    """Calculate packet size in bytes for energy consumption (cached on the packet)"""
+    size = packet.nbytes
+    if size is None:
+        size = 20  # Base header (type, source, dest, etc.)
+        if packet.kind == 'DATA':
+            size += packet.get('payload_size', 100)
+        else:
+            size += PACKET_PAYLOAD_SIZES.get(packet.kind, 30)  # 30: default for other message types
+        packet.nbytes = size
+    return size
+
+
+class EnergyLedger(wsn.RadioEnergy):
+    """Radio energy accountant of all nodes (attached as sim.radio) with their energy budget, indexed by node id.
+    The kernel reports sleep/wake up transitions and TX/RX bursts to it, snapshots are read as NumPy arrays.
+    Nodes are not checked for depletion on every packet. A node is settled (remaining energy computed exactly) only
+    when it has used half of the energy it had at its last settle by the worst case rates (byte budget and deadline).
+
+    Attributes:
+        initial (List): initial energy
+        packets_lost (List): packets lost by packet loss simulation
+        alive (List): False once node is depleted
+        death_time (List): time of depletion, NaN while alive
+        role (List): Roles value of node
+        budget (List): bytes a node may still send or receive before it is settled again
+        deadline (List): time until which a node need not be settled
+    """
+    DATA_RATE = 250000  # bytes/s, radio airtime of a packet is its size divided by it
+
+    def __init__(self):
+        super().__init__(TX_ENERGY_PER_BYTE, RX_ENERGY_PER_BYTE, IDLE_ENERGY_PER_SECOND, SLEEP_ENERGY_PER_SECOND,
+                         self.DATA_RATE, calculate_packet_size)
+        self.initial = []
+        self.packets_lost = []
+        self.alive = []
+        self.death_time = []
+        self.role = []
+        self.budget = []
+        self.deadline = []
+        self.max_byte_cost = max(TX_ENERGY_PER_BYTE, RX_ENERGY_PER_BYTE)
+        self.max_rate = max(IDLE_ENERGY_PER_SECOND, SLEEP_ENERGY_PER_SECOND)
+
+    def add_nodes(self, count):
+        super().add_nodes(count)
+        self.initial.extend([INITIAL_ENERGY_JOULES] * count)
+        self.packets_lost.extend([0] * count)
+        self.alive.extend([True] * count)
+        self.death_time.extend([math.nan] * count)
+        self.role.extend([Roles.UNDISCOVERED.value] * count)
+        self.budget.extend([0.0] * count)  # settled on first check
+        self.deadline.extend([0.0] * count)
+
+    def register(self, node_id, now):
+        """Start energy accounting of node with full energy"""
+        if node_id >= len(self):
+            self.add_nodes(node_id + 1 - len(self))
+        self.settle(node_id, now)
+
+    def set_role(self, node_id, role):
+        if node_id >= len(self):
+            self.add_nodes(node_id + 1 - len(self))
+        self.role[node_id] = role.value
+
+    def burst(self, node_id, state, nbytes, now):
+        counted = super().burst(node_id, state, nbytes, now)
+        if counted:
+            self.budget[node_id] -= nbytes
+        return counted
+
+    def depleted(self, node_id, now):
+        """True if node has no energy left (checked exactly only when its budget or deadline runs out)"""
+        if not self.alive[node_id]:
+            return False
+        if self.budget[node_id] > 0 and now < self.deadline[node_id]:
+            return False
+        return self.settle(node_id, now) <= 0
+
+    def depleted_nodes(self, now):
+        """Ids of alive nodes found depleted at time now, also those which neither send nor receive (e.g. sleeping)"""
+        return [node_id for node_id, deadline in enumerate(self.deadline)
+                if now >= deadline and self.depleted(node_id, now)]
+
+    def remaining(self, node_id, now):
+        """Remaining energy of node at time now"""
+        if not self.alive[node_id]:
+            return 0.0
+        return self.initial[node_id] - self.consumed(node_id, now)
+
+    def settle(self, node_id, now):
+        """Compute remaining energy of node exactly and renew its budget and deadline, returns remaining energy"""
+        remaining = self.remaining(node_id, now)
+        half = remaining / 2
+        self.budget[node_id] = half / self.max_byte_cost if self.max_byte_cost > 0 else math.inf
+        self.deadline[node_id] = now + half / self.max_rate if self.max_rate > 0 else math.inf
+        return remaining
+
+    def die(self, node_id, now, death_time):
+        """Node is depleted: its radio is turned off (death time is elapsed time, including fast forward)"""
+        self.transition(node_id, wsn.RADIO_OFF, now)
+        self.alive[node_id] = False
+        self.death_time[node_id] = death_time
+
+    def add_usage(self, times, counters, now):
+        super().add_usage(times, counters, now)
+        for node_id, alive in enumerate(self.alive):
+            if alive:
+                self.settle(node_id, now)  # budgets and deadlines were given for less usage
+
+    def remaining_energies(self, now):
+        """Remaining energy of all nodes at time now as an array, 0 for dead nodes"""
+        alive = np.array(self.alive, dtype=bool)
+        return np.where(alive, np.array(self.initial, dtype=float) - self.energies(now).sum(axis=1), 0.0)
+
+    def snapshot(self, now, timestamp=None):
+        """Energy state of all nodes at time now as arrays (one vectorised pass), timestamp defaults to now"""
+        n = len(self)
+        times = self.times(now)
+        energies = times * self.power
+        alive = np.array(self.alive, dtype=bool)
+        initial = np.array(self.initial, dtype=float)
+        remaining = np.where(alive, np.maximum(initial - energies.sum(axis=1), 0.0), 0.0)
+        return {
+            'timestamp': now if timestamp is None else timestamp,
+            'node_id': np.arange(n),
+            'role': np.array(self.role, dtype=np.int64),
+            'initial_energy': initial,
+            'remaining_energy': remaining,
+            'energy_consumed': initial - remaining,
+            'energy_tx': energies[:, wsn.RADIO_TX],
+            'energy_rx': energies[:, wsn.RADIO_RX],
+            'energy_idle': energies[:, wsn.RADIO_IDLE],
+            'energy_sleep': energies[:, wsn.RADIO_SLEEP],
+            'time_tx': times[:, wsn.RADIO_TX],
+            'time_rx': times[:, wsn.RADIO_RX],
+            'time_idle': times[:, wsn.RADIO_IDLE],
+            'time_sleep': times[:, wsn.RADIO_SLEEP],
+            'is_alive': alive,
+            'death_time': np.array(self.death_time, dtype=float),
+            'packets_sent': np.array(self.packets_sent, dtype=np.int64),
+            'packets_received': np.array(self.packets_received, dtype=np.int64),
+            'packets_lost': np.array(self.packets_lost, dtype=np.int64),
+            'bytes_sent': np.array(self.bytes_sent, dtype=np.int64),
+            'bytes_received': np.array(self.bytes_received, dtype=np.int64),
+        }
+
+
+ENERGY = EnergyLedger()
+ROLE_NAMES = {role.value: role.name for role in Roles}
+
+
+###########################################################
+class EnergyTimeline:
+    """Columnar store of energy samples, one row per node per sample.
+    Rows are written into preallocated NumPy chunks (one array per column). Full chunks stay in memory or, if
+    spill_dir is given, are saved as one .npy file per column and read back memory-mapped, so memory use is
+    bounded by one chunk.
+
+    Attributes:
+        chunk_rows (int): rows per chunk
+        spill_dir (str): directory of spilled chunks, None to keep chunks in memory
+        chunks (List): full chunks, as dicts of column arrays or as paths of spilled chunks
+        current (Dict): column arrays of the chunk being filled
+        filled (int): rows used in current chunk
+    """
+    COLUMNS = (
+        ('timestamp', np.float64), ('node_id', np.int64), ('role', np.int8),
+        ('remaining_energy', np.float64), ('energy_consumed', np.float64),
+        ('energy_tx', np.float64), ('energy_rx', np.float64), ('energy_idle', np.float64), ('energy_sleep', np.float64),
+        ('is_alive', np.bool_), ('packets_sent', np.int64), ('packets_received', np.int64), ('packets_lost', np.int64),
+        ('bytes_sent', np.int64), ('bytes_received', np.int64),
+    )
+
+    def __init__(self, chunk_rows=65536, spill_dir=None):
+        self.chunk_rows = chunk_rows
+        self.spill_dir = spill_dir
+        self.chunks = []
+        self.current = self._new_chunk()
+        self.filled = 0
+
+    def _new_chunk(self):
+        return {name: np.empty(self.chunk_rows, dtype=dtype) for name, dtype in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.chunks) * self.chunk_rows + self.filled
+
+    def append(self, snapshot):
+        """Add rows of an EnergyLedger snapshot"""
+        rows = len(snapshot['node_id'])
+        start = 0
+        while start < rows:
+            count = min(rows - start, self.chunk_rows - self.filled)
+            end = self.filled + count
+            for name, _ in self.COLUMNS:
+                if name == 'timestamp':
+                    self.current[name][self.filled:end] = snapshot['timestamp']
+                else:
+                    self.current[name][self.filled:end] = snapshot[name][start:start + count]
+            self.filled = end
+            start += count
+            if self.filled == self.chunk_rows:
+                self._close_chunk()
+
+    def _close_chunk(self):
+        if self.spill_dir is None:
+            self.chunks.append(self.current)
+        else:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f"energy_timeline_{len(self.chunks):05d}")
+            for name, _ in self.COLUMNS:
+                np.save(f"{path}_{name}.npy", self.current[name])
+            self.chunks.append(path)
+        self.current = self._new_chunk()
+        self.filled = 0
+
+    def iter_chunks(self):
+        """Yields chunks as dicts of column arrays (memory-mapped for spilled chunks)"""
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                yield {name: np.load(f"{chunk}_{name}.npy", mmap_mode='r') for name, _ in self.COLUMNS}
+            else:
+                yield chunk
+        if self.filled:
+            yield {name: column[:self.filled] for name, column in self.current.items()}
+
+    def column(self, name):
+        """Whole column as one array"""
+        parts = [chunk[name] for chunk in self.iter_chunks()]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dict(self.COLUMNS)[name])
+
+
+ENERGY_TIMELINE = EnergyTimeline(ENERGY_TIMELINE_CHUNK_ROWS, ENERGY_TIMELINE_SPILL_DIR)
+
 
 ###########################################################
 class SensorNode(wsn.Node):
@@ -70,8 +583,12 @@ class SensorNode(wsn.Node):
         is_root_eligible (bool): keeps eligibility to be root
         c_probe (int): probe message counter
         th_probe (int): probe message threshold
-        neighbors_table (Dict): keeps the neighbor information with received heart beat messages
+        neighbors_table (IndexedTable): NeighborEntry per neighbor gui, from received heart beat messages
         neighbor_last_seen (Dict): timestamp of last heartbeat from each neighbor (for timeout)
+        neighbor_expiry (ExpiryHeap): neighbor_last_seen timestamps, oldest first
+        multihop_expiry (ExpiryHeap): multihop_neighbors 'last_seen' timestamps, oldest first
+        candidate_parents_table (Dict): candidate parent guis in arrival order, values are arrival sequence numbers
+        parent_queues (Dict): PriorityIndex of candidate parents per group ('ch', 'registered', 'router')
     """
 
     ###################
@@ -91,10 +608,16 @@ class SensorNode(wsn.Node):
         self.c_probe = 0  # c means counter and probe is the name of counter
         self.th_probe = 10  # th means threshold and probe is the name of threshold
         self.hop_count = 99999
-        self.neighbors_table = {}  # keeps neighbor information with received HB messages
+        self.route_cache = {}  # dest addr -> (context, route), flushed by routing table changes
+        self.route_cache_stats = {'hits': 0, 'misses': 0}
+        self.neighbors_table = IndexedTable(neighbor_index_keys, self.on_neighbor_change)  # keeps neighbor information with received HB messages
         self.neighbor_last_seen = {}  # CTM-AdHoc: timestamp of last contact with each neighbor
-        self.candidate_parents_table = []
-        self.child_networks_table = {}
+        self.neighbor_expiry = ExpiryHeap()
+        self.multihop_expiry = ExpiryHeap()
+        self.candidate_parents_table = {}  # ordered set of guis
+        self.candidate_seq = itertools.count()
+        self.parent_queues = {'ch': wsn.PriorityIndex(), 'registered': wsn.PriorityIndex(), 'router': wsn.PriorityIndex()}
+        self.child_networks_table = IndexedTable(networks_index_keys, self.on_child_networks_change)
         self.members_table = []
         self.received_JR_guis = []  # keeps received Join Request global unique ids
         
@@ -125,34 +648,12 @@ class SensorNode(wsn.Node):
         self.cancelled_promotions = set()  # Track cancelled promotions (for greens)
         
         # Multi-Hop Neighbor Discovery
-        self.multihop_neighbors = {}  # 2-hop and beyond neighbors
+        self.multihop_neighbors = IndexedTable(addr_index_keys, self.on_multihop_change)  # 2-hop and beyond neighbors
         self.neighbor_share_sequence = 0  # Sequence number for neighbor table updates
         
-        # Energy Model
+        # Energy Model: energy state and packet statistics are kept in the ENERGY ledger
         if ENABLE_ENERGY_MODEL:
-            self.initial_energy = INITIAL_ENERGY_JOULES
-            self.remaining_energy = INITIAL_ENERGY_JOULES
-            self.is_alive = True
-            
-            # Time tracking per state
-            self.time_in_tx = 0.0
-            self.time_in_rx = 0.0
-            self.time_in_idle = 0.0
-            self.time_in_sleep = 0.0
-            self.last_energy_update = 0.0  # Will be set to self.now on first use
-            
-            # Energy consumption by source
-            self.energy_tx = 0.0
-            self.energy_rx = 0.0
-            self.energy_idle = 0.0
-            self.energy_sleep = 0.0
-            
-            # Packet statistics
-            self.packets_sent = 0
-            self.packets_received = 0
-            self.packets_lost = 0
-            self.bytes_sent = 0
-            self.bytes_received = 0
+            ENERGY.register(self.id, self.now)
         
         # Join time tracking
         self.wakeup_time = None      # When node became UNREGISTERED
@@ -170,6 +671,28 @@ class SensorNode(wsn.Node):
         """
         self.set_timer('TIMER_ARRIVAL', self.arrival)
 
+    ###################
+    @property
+    def parent_gui(self):
+        return self._parent_gui
+
+    @parent_gui.setter
+    def parent_gui(self, value):
+        """Keep invariant checker's children index current"""
+        INVARIANTS.parent_changed(self, getattr(self, '_parent_gui', None), value)
+        self._parent_gui = value
+
+    @property
+    def connected_CHs(self):
+        return self._connected_CHs
+
+    @connected_CHs.setter
+    def connected_CHs(self, value):
+        """Keep invariant checker's bridges index current (connected_CHs[1] is the bridged child CH)"""
+        old = getattr(self, '_connected_CHs', [])
+        INVARIANTS.bridge_changed(self, old[1] if len(old) > 1 else None, value[1] if len(value) > 1 else None)
+        self._connected_CHs = value
+
     ###################
 
     def set_role(self, new_role, *, recolor=True):
@@ -180,7 +703,13 @@ class SensorNode(wsn.Node):
             if ROLE_COUNTS[old_role] <= 0:
                 ROLE_COUNTS.pop(old_role, None)
         ROLE_COUNTS[new_role] += 1
+        self.sim.update_role_index(self, old_role, new_role)
         self.role = new_role
+        if ENABLE_ENERGY_MODEL:
+            ENERGY.set_role(self.id, new_role)
+        if new_role == Roles.ROOT and self.sim.lifetime is not None:
+            self.sim.lifetime.set_root(self.id)
+        INVARIANTS.role_changed(self)
         
         # Track wakeup time (when node becomes UNREGISTERED)
         if new_role == Roles.UNREGISTERED and self.wakeup_time is None:
@@ -220,61 +749,14 @@ class SensorNode(wsn.Node):
     # Energy Model Methods
     ###################
     
-    def calculate_packet_size(self, packet):
-        """Calculate packet size in bytes for energy consumption"""
-        if not ENABLE_ENERGY_MODEL:
-            return 0
-        
-        size = 20  # Base header (type, source, dest, etc.)
-        
-        msg_type = packet.get('type', '')
-        if msg_type == 'HEART_BEAT':
-            size += 50  # Position, role, hop count, network info
-        elif msg_type in ['JOIN_REQUEST', 'JOIN_REPLY', 'JOIN_ACK']:
-            size += 35
-        elif msg_type in ['NETWORK_REQUEST', 'NETWORK_REPLY']:
-            size += 40
-        elif msg_type == 'BECOME_CH':
-            size += 45
-        elif msg_type == 'DATA':
-            size += packet.get('payload_size', 100)
-        elif msg_type == 'ROUTER_NOMINATION':
-            size += 30
-        elif msg_type == 'NEIGHBOR_SHARE':
-            size += 60  # Neighbor table data
-        else:
-            size += 30  # Default for other message types
-        
-        return size
-    
-    def consume_energy(self, amount, source):
-        """Consume energy and track by source (TX/RX/IDLE/SLEEP)"""
-        if not ENABLE_ENERGY_MODEL or not hasattr(self, 'is_alive') or not self.is_alive:
-            return
-        
-        self.remaining_energy -= amount
-        
-        # Track by source
-        if source == 'TX':
-            self.energy_tx += amount
-        elif source == 'RX':
-            self.energy_rx += amount
-        elif source == 'IDLE':
-            self.energy_idle += amount
-        elif source == 'SLEEP':
-            self.energy_sleep += amount
-        
-        # Check if node dies from energy depletion
-        if self.remaining_energy <= 0:
-            self.die_from_energy_depletion()
+    @property
+    def is_alive(self):
+        """False once the node is depleted (always True without energy model)"""
+        return not ENABLE_ENERGY_MODEL or ENERGY.alive[self.id]
     
     def die_from_energy_depletion(self):
         """Node runs out of energy and dies permanently"""
-        if not hasattr(self, 'is_alive'):
-            return
-        
-        self.is_alive = False
-        self.remaining_energy = 0
+        ENERGY.die(self.id, self.now, self.sim.elapsed)
         
         # Turn off radio - set to UNDISCOVERED
         self.set_role(Roles.UNDISCOVERED, recolor=False)
@@ -287,40 +769,14 @@ class SensorNode(wsn.Node):
         self.kill_timer('TIMER_NEIGHBOR_SHARE')
         
         # Log death
-        self.log(f"[ENERGY] Node {self.id} DIED (energy depleted) at {self.now:.2f}s")
+        self.log(f"[ENERGY] Node {self.id} DIED (energy depleted) at {self.sim.elapsed:.2f}s")
         
         # Visual indication - gray for dead
         self.scene.nodecolor(self.id, 0.5, 0.5, 0.5)
-    
-    def update_idle_energy(self):
-        """Update idle/sleep energy consumption based on time elapsed"""
-        if not ENABLE_ENERGY_MODEL or not hasattr(self, 'is_alive') or not self.is_alive:
-            return
-        
-        # Initialize last_energy_update if not set
-        if self.last_energy_update == 0.0:
-            self.last_energy_update = self.now
-            return
         
-        time_delta = self.now - self.last_energy_update
-        self.last_energy_update = self.now
-        
-        if time_delta <= 0:
-            return
-        
-        # Determine state (sleep or idle)
-        if self.role == Roles.UNDISCOVERED:
-            # Sleeping
-            energy = time_delta * SLEEP_ENERGY_PER_SECOND
-            self.consume_energy(energy, 'SLEEP')
-            self.time_in_sleep += time_delta
-        else:
-            # Idle listening
-            energy = time_delta * IDLE_ENERGY_PER_SECOND
-            self.consume_energy(energy, 'IDLE')
-            self.time_in_idle += time_delta
-
-
+        # Lifetime metrics, may stop the simulation
+        if self.sim.lifetime is not None:
+            self.sim.lifetime.node_died(self.id)
     
     def become_unregistered(self):
         if self.role != Roles.UNDISCOVERED:
@@ -342,9 +798,12 @@ class SensorNode(wsn.Node):
         self.c_probe = 0
         self.th_probe = 10
         self.hop_count = 99999
-        self.neighbors_table = {}
-        self.candidate_parents_table = []
-        self.child_networks_table = {}
+        self.neighbors_table = IndexedTable(neighbor_index_keys, self.on_neighbor_change)
+        self.candidate_parents_table = {}
+        for queue in self.parent_queues.values():
+            queue.clear()
+        self.child_networks_table = IndexedTable(networks_index_keys, self.on_child_networks_change)
+        self.route_cache.clear()
         self.members_table = []
         self.received_JR_guis = []  # keeps received Join Request global unique ids
         self.unregistered_since = self.now  # Track when became yellow
@@ -359,50 +818,39 @@ class SensorNode(wsn.Node):
         self.set_timer('TIMER_YELLOW_CH', self.adaptive_ch_timeout)
     
     ###################
-    # Override send() to track TX energy
+    # Override send() for energy model
     ###################
     
     def send(self, pck):
-        """Override send to track TX energy consumption"""
-        # Check if node is alive
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'is_alive') and not self.is_alive:
-            return  # Dead nodes can't send
-        
-        # Update idle energy before TX
+        """Override send to drop packets of dead nodes and lost packets, and check energy after TX"""
+        pck = wsn.as_packet(pck)
         if ENABLE_ENERGY_MODEL:
-            self.update_idle_energy()
-        
-        # Check packet loss
-        if ENABLE_PACKET_LOSS and hasattr(self, 'packets_lost'):
-            if random.random() < PACKET_LOSS_PROBABILITY:
-                self.packets_lost += 1
+            # Check if node is alive
+            if not ENERGY.alive[self.id]:
+                return  # Dead nodes can't send
+            
+            # Check packet loss
+            if ENABLE_PACKET_LOSS and random.random() < PACKET_LOSS_PROBABILITY:
+                ENERGY.packets_lost[self.id] += 1
                 return  # Packet lost
-        
-        # Calculate TX energy
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'bytes_sent'):
-            packet_size = self.calculate_packet_size(pck)
-            tx_energy = packet_size * TX_ENERGY_PER_BYTE
-            self.consume_energy(tx_energy, 'TX')
-            self.bytes_sent += packet_size
-            self.packets_sent += 1
-            tx_time = packet_size / 250000  # 250 kbps data rate
-            self.time_in_tx += tx_time
-
-        # Call parent send
+            
+        # Call parent send, it reports the TX burst to the ledger
         super().send(pck)
+        if ENABLE_ENERGY_MODEL and ENERGY.depleted(self.id, self.now):
+            self.die_from_energy_depletion()
 
     ###################
     def update_neighbor(self, pck):
-        pck['arrival_time'] = self.now
         # compute Euclidean distance between self and neighbor
+        distance = None
         if pck['gui'] in NODE_POS and self.id in NODE_POS:
             x1, y1 = NODE_POS[self.id]
             x2, y2 = NODE_POS[pck['gui']]
-            pck['distance'] = math.hypot(x1 - x2, y1 - y2)
-        self.neighbors_table[pck['gui']] = pck
+            distance = math.hypot(x1 - x2, y1 - y2)
+        self.neighbors_table[pck['gui']] = NeighborEntry(pck, distance, self.now)
         
         # CTM-AdHoc: Update last seen timestamp for neighbor timeout
-        self.neighbor_last_seen[pck['gui']] = self.now
+        self.touch_neighbor(pck['gui'])
         
         # Track CH heartbeats for adaptive promotion
         if pck.get('role') == Roles.CLUSTER_HEAD:
@@ -410,30 +858,36 @@ class SensorNode(wsn.Node):
 
         if pck['gui'] not in self.child_networks_table.keys() or pck['gui'] not in self.members_table:
             if pck['gui'] not in self.candidate_parents_table:
-                self.candidate_parents_table.append(pck['gui'])
+                self.candidate_parents_table[pck['gui']] = next(self.candidate_seq)
+                self.refresh_parent_candidate(pck['gui'])
+
+    def touch_neighbor(self, gui):
+        """CTM-AdHoc: Record contact with neighbor gui for the neighbor timeout"""
+        if self.neighbor_last_seen.get(gui) != self.now:
+            self.neighbor_last_seen[gui] = self.now
+            self.neighbor_expiry.push(self.now, gui)
+
+    def multihop_last_seen(self, gui):
+        info = self.multihop_neighbors.get(gui)
+        return None if info is None else info['last_seen']
     
     def clean_stale_neighbors(self):
         """CTM-AdHoc: Remove neighbors that haven't sent heartbeat within NEIGHBOR_TIMEOUT"""
-        stale_neighbors = []
-        for gui, last_seen in self.neighbor_last_seen.items():
-            if self.now - last_seen > NEIGHBOR_TIMEOUT:
-                stale_neighbors.append(gui)
+        stale_neighbors = self.neighbor_expiry.pop_expired(self.now, NEIGHBOR_TIMEOUT, self.neighbor_last_seen.get)
         
         for gui in stale_neighbors:
             if gui in self.neighbors_table:
                 del self.neighbors_table[gui]
             if gui in self.neighbor_last_seen:
                 del self.neighbor_last_seen[gui]
-            if gui in self.candidate_parents_table:
-                self.candidate_parents_table.remove(gui)
+            if self.candidate_parents_table.pop(gui, None) is not None:
+                self.refresh_parent_candidate(gui)
             self.log(f"Removed stale neighbor {gui}")
         
         # Multi-Hop: Clean stale 2-hop neighbors
         if ENABLE_MULTIHOP_NEIGHBORS:
-            stale_multihop = []
-            for gui, info in self.multihop_neighbors.items():
-                if self.now - info['last_seen'] > NEIGHBOR_TIMEOUT * 2:  # 2x timeout for multi-hop
-                    stale_multihop.append(gui)
+            # 2x timeout for multi-hop
+            stale_multihop = self.multihop_expiry.pop_expired(self.now, NEIGHBOR_TIMEOUT * 2, self.multihop_last_seen)
             
             for gui in stale_multihop:
                 del self.multihop_neighbors[gui]
@@ -450,80 +904,63 @@ class SensorNode(wsn.Node):
             self.log(f"[JOIN] select_and_join called with no candidates - waiting for responses")
             return
         
-        registered_candidates = []
-        router_candidates = []
-        ch_candidates = []
-        
-        for gui in self.candidate_parents_table:
-            if gui in self.neighbors_table:
-                role = self.neighbors_table[gui].get('role')
-                if role == Roles.REGISTERED:
-                    registered_candidates.append(gui)
-                elif role == Roles.ROUTER:
-                    router_candidates.append(gui)
-                elif role in [Roles.CLUSTER_HEAD, Roles.ROOT]:
-                    ch_candidates.append(gui)
-        
-        if ch_candidates:
-            min_hop = 99999
-            min_hop_gui = None
-            for gui in ch_candidates:
-                if gui in self.neighbors_table:
-                    hop = self.neighbors_table[gui]['hop_count']
-                    if hop < min_hop or (hop == min_hop and (min_hop_gui is None or gui < min_hop_gui)):
-                        min_hop = hop
-                        min_hop_gui = gui
-            
-            if min_hop_gui is not None:
-                selected_addr = self.neighbors_table[min_hop_gui]['source']
-                role = self.neighbors_table[min_hop_gui].get('role')
-                self.log(f"[JOIN] Selecting {role.name} {min_hop_gui} (hop={min_hop}) - no greens available")
-                self.send_join_request(selected_addr)
-                self.set_timer('TIMER_JOIN_REQUEST', 15)
-                return
+        # Candidates which are also neighbors wait in parent_queues, ordered by (hop, gui) or (distance, arrival)
+        ch_candidate = self.parent_queues['ch'].peek()
+        if ch_candidate is not None:
+            min_hop, min_hop_gui = ch_candidate
+            selected_addr = self.neighbors_table[min_hop_gui].source
+            role = self.neighbors_table[min_hop_gui].role
+            self.log(f"[JOIN] Selecting {role.name} {min_hop_gui} (hop={min_hop}) - no greens available")
+            self.send_join_request(selected_addr)
+            self.set_timer('TIMER_JOIN_REQUEST', 15)
+            return
             
         # Try REGISTERED nodes first ( router nomination)
-        if registered_candidates:
-            min_distance = 999999
-            closest_green = None
-            
-            for gui in registered_candidates:
-                if gui in self.neighbors_table:
-                    distance = self.neighbors_table[gui]['distance']
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_green = gui
-            
-            if closest_green is not None:
-                selected_addr = self.neighbors_table[closest_green]['source']
-                self.log(f"[JOIN] Selecting REGISTERED {closest_green} (dist={min_distance:.1f}m) - direct to green")
-                self.send_join_request(selected_addr)
-                self.set_timer('TIMER_JOIN_REQUEST', 15)
-                return
+        # Unknown distances are queued as inf and sort last, so the head is only skipped when no distance is known
+        registered_candidate = self.parent_queues['registered'].peek()
+        if registered_candidate is not None and registered_candidate[0][0] < 999999:
+            (min_distance, _), closest_green = registered_candidate
+            selected_addr = self.neighbors_table[closest_green].source
+            self.log(f"[JOIN] Selecting REGISTERED {closest_green} (dist={min_distance:.1f}m) - direct to green")
+            self.send_join_request(selected_addr)
+            self.set_timer('TIMER_JOIN_REQUEST', 15)
+            return
         
         # Try ROUTER nodes second
-        if router_candidates:
-            min_hop = 99999
-            min_hop_gui = None
-            for gui in router_candidates:
-                if gui in self.neighbors_table:
-                    hop = self.neighbors_table[gui]['hop_count']
-                    if hop < min_hop or (hop == min_hop and (min_hop_gui is None or gui < min_hop_gui)):
-                        min_hop = hop
-                        min_hop_gui = gui
-            
-            if min_hop_gui is not None:
-                selected_addr = self.neighbors_table[min_hop_gui]['source']
-                self.log(f"[JOIN] Selecting ROUTER {min_hop_gui} (hop={min_hop})")
-                self.send_join_request(selected_addr)
-                self.set_timer('TIMER_JOIN_REQUEST', 15)
-                return
+        router_candidate = self.parent_queues['router'].peek()
+        if router_candidate is not None:
+            min_hop, min_hop_gui = router_candidate
+            selected_addr = self.neighbors_table[min_hop_gui].source
+            self.log(f"[JOIN] Selecting ROUTER {min_hop_gui} (hop={min_hop})")
+            self.send_join_request(selected_addr)
+            self.set_timer('TIMER_JOIN_REQUEST', 15)
+            return
         # Fallback: Use CH/ROOT only if no REGISTERED or ROUTER available
         
         
         # No valid candidates in neighbor table yet
         self.log(f"[JOIN] Candidates in table but not in neighbors yet - waiting for next cycle")
     
+    ###################
+    def refresh_parent_candidate(self, gui):
+        """Puts gui in the parent queue of its neighbor role while it is both a candidate parent and a neighbor"""
+        entry = self.neighbors_table.get(gui)
+        seq = self.candidate_parents_table.get(gui)
+        group = priority = None
+        if entry is not None and seq is not None:
+            if entry.role == Roles.REGISTERED:
+                distance = entry.distance if entry.distance is not None else math.inf
+                group, priority = 'registered', (distance, seq)
+            elif entry.role == Roles.ROUTER:
+                group, priority = 'router', entry.hop_count
+            elif entry.role in [Roles.CLUSTER_HEAD, Roles.ROOT]:
+                group, priority = 'ch', entry.hop_count
+        for name, queue in self.parent_queues.items():
+            if name == group:
+                queue.set(gui, priority)
+            else:
+                queue.discard(gui)
+
     ###################
     def _calculate_adaptive_ch_timeout(self):
         """Calculate adaptive CH promotion timeout based on node density"""
@@ -535,8 +972,8 @@ class SensorNode(wsn.Node):
     
     def has_ch_in_range(self):
         """Check if there's a cluster head in communication range"""
-        for gui, neighbor_info in self.neighbors_table.items():
-            if neighbor_info.get('role') == Roles.CLUSTER_HEAD:
+        for neighbor_info in self.neighbors_table.values():
+            if neighbor_info.role == Roles.CLUSTER_HEAD:
                 return True
         return False
     
@@ -658,103 +1095,109 @@ class SensorNode(wsn.Node):
         if not ENABLE_HYBRID_ROUTING:
             # Original tree-based routing
             if self.role != Roles.ROOT:
-                pck['next_hop'] = self.neighbors_table[self.parent_gui]['ch_addr']
+                pck['next_hop'] = self.neighbors_table[self.parent_gui].ch_addr
             if self.ch_addr is not None:
                 if pck['dest'].net_addr == self.ch_addr.net_addr:
                     pck['next_hop'] = pck['dest']
                 else:
-                    for child_gui, child_networks in self.child_networks_table.items():
-                        if pck['dest'].net_addr in child_networks:
-                            pck['next_hop'] = self.neighbors_table[child_gui]['addr']
-                            break
+                    dest_children = self.child_networks_table.lookup(pck['dest'].net_addr)
+                    if dest_children:
+                        pck['next_hop'] = self.neighbors_table[dest_children[0]].addr
             self.send(pck)
             return
         
         # CTM-AdHoc Hybrid Routing Logic
-        routed = False
+        # Cached decisions stay valid until a routing table changes (the tables flush the cache)
+        # or the parts of node state the decision reads change (checked with context)
+        context = (self.role == Roles.ROOT, self.ch_addr is None, self.parent_gui)
+        cached = self.route_cache.get(dest_addr)
+        if cached is not None and cached[0] == context:
+            self.route_cache_stats['hits'] += 1
+            route = cached[1]
+        else:
+            self.route_cache_stats['misses'] += 1
+            route = self.find_route(dest_addr)
+            if route is not None:
+                self.route_cache[dest_addr] = (context, route)
+        
+        if route is not None:
+            stat, next_hop, msg = route
+            pck['next_hop'] = next_hop
+            self.routing_stats[stat] += 1
+            self.log(msg)
+            self.send(pck)
+            return
+        
+        # Route failure - trigger re-probe and neighbor share
+        self.routing_stats['route_failures'] += 1
+        self.log(f"[CTM-AdHoc] Route failure to {dest_addr}, triggering re-probe")
+        self.send_probe()
+        if ENABLE_MULTIHOP_NEIGHBORS:
+            self.send_neighbor_table_share()  # Share neighbors to help discover routes
+    
+    ###################
+    def find_route(self, dest_addr):
+        """CTM-AdHoc routing decision for dest_addr
+        
+        Returns (routing_stats key, next hop, log message), or None on route failure
+
+        """
+        # Routing indexes map dest to table entries; lookup() keeps table order, so the same entry wins as in a scan
+        dest_neighbors = self.neighbors_table.lookup(dest_addr)
         
         #Direct  check if destination is a direct neighbor
-        for neighbor_gui, neighbor_info in self.neighbors_table.items():
-            neighbor_addr = neighbor_info.get('addr')
-            if neighbor_addr == dest_addr:
-                pck['next_hop'] = dest_addr
-                self.routing_stats['direct_mesh'] += 1
-                self.log(f"[CTM-AdHoc] Direct mesh to neighbor {neighbor_gui}")
-                self.send(pck)
-                routed = True
-                break
-        
-        if routed:
-            return
+        if dest_neighbors:
+            return 'direct_mesh', dest_addr, f"[CTM-AdHoc] Direct mesh to neighbor {dest_neighbors[0]}"
         
         # Step 2: if we're a cluster head and dest is in our cluster
+        # (it can only match a neighbor with dest addr, which step 1 takes first, so cached routes ignore role and members)
         if self.role == Roles.CLUSTER_HEAD and self.ch_addr is not None:
             if hasattr(dest_addr, 'net_addr') and dest_addr.net_addr == self.ch_addr.net_addr:
                 # Destination is in our cluster
-                for member_gui in self.members_table:
-                    if member_gui in self.neighbors_table:
-                        member_addr = self.neighbors_table[member_gui].get('addr')
-                        if member_addr == dest_addr:
-                            pck['next_hop'] = dest_addr
-                            self.routing_stats['intra_cluster'] += 1
-                            self.log(f"[CTM-AdHoc] Intra-cluster to member {member_gui}")
-                            self.send(pck)
-                            routed = True
-                            break
-        
-        if routed:
-            return
+                dest_members = [gui for gui in dest_neighbors if gui in self.members_table]
+                if dest_members:
+                    member_gui = min(dest_members, key=self.members_table.index)
+                    return 'intra_cluster', dest_addr, f"[CTM-AdHoc] Intra-cluster to member {member_gui}"
         
         # Step 2.5: Multi-Hop Mesh Forwarding - check if destination is a 2-hop neighbor
         if ENABLE_MULTIHOP_NEIGHBORS:
-            for neighbor_id, neighbor_info in self.multihop_neighbors.items():
-                neighbor_addr = neighbor_info.get('addr')
-                if neighbor_addr == dest_addr:
-                    # Route through intermediate node
-                    via_node = neighbor_info['via']
-                    if via_node in self.neighbors_table:
-                        pck['next_hop'] = self.neighbors_table[via_node]['addr']
-                        self.routing_stats['multihop_routes'] += 1
-                        self.log(f"[CTM-AdHoc] Multi-hop to {neighbor_id} via {via_node}")
-                        self.send(pck)
-                        routed = True
-                        break
-        
-        if routed:
-            return
+            for neighbor_id in self.multihop_neighbors.lookup(dest_addr):
+                # Route through intermediate node
+                via_node = self.multihop_neighbors[neighbor_id]['via']
+                if via_node in self.neighbors_table:
+                    return ('multihop_routes', self.neighbors_table[via_node].addr,
+                            f"[CTM-AdHoc] Multi-hop to {neighbor_id} via {via_node}")
         
         # STEP 3: Downward Tree Forwarding - check if dest cluster is in child networks
         if self.ch_addr is not None and hasattr(dest_addr, 'net_addr'):
-            for child_gui, child_networks in self.child_networks_table.items():
-                if dest_addr.net_addr in child_networks:
-                    if child_gui in self.neighbors_table:
-                        pck['next_hop'] = self.neighbors_table[child_gui]['addr']
-                        self.routing_stats['downward_tree'] += 1
-                        self.log(f"[CTM-AdHoc] Downward tree via child {child_gui}")
-                        self.send(pck)
-                        routed = True
-                        break
-        
-        if routed:
-            return
+            for child_gui in self.child_networks_table.lookup(dest_addr.net_addr):
+                if child_gui in self.neighbors_table:
+                    return ('downward_tree', self.neighbors_table[child_gui].addr,
+                            f"[CTM-AdHoc] Downward tree via child {child_gui}")
         
         # FALLBACK: Upward Tree Forwarding - forward to parent
         if self.role != Roles.ROOT and self.parent_gui is not None:
             if self.parent_gui in self.neighbors_table:
-                pck['next_hop'] = self.neighbors_table[self.parent_gui]['ch_addr']
-                self.routing_stats['upward_tree'] += 1
-                self.log(f"[CTM-AdHoc] Upward tree to parent {self.parent_gui}")
-                self.send(pck)
-                routed = True
-        
-        if not routed:
-            # Route failure - trigger re-probe and neighbor share
-            self.routing_stats['route_failures'] += 1
-            self.log(f"[CTM-AdHoc] Route failure to {dest_addr}, triggering re-probe")
-            self.send_probe()
-            if ENABLE_MULTIHOP_NEIGHBORS:
-                self.send_neighbor_table_share()  # Share neighbors to help discover routes
+                return ('upward_tree', self.neighbors_table[self.parent_gui].ch_addr,
+                        f"[CTM-AdHoc] Upward tree to parent {self.parent_gui}")
+        
+        return None
+    
+    ###################
+    def on_neighbor_change(self, gui, old, new):
+        """Flush route cache when a neighbor appears, disappears or changes an address used for routing"""
+        if old is None or new is None or old.addr != new.addr or old.ch_addr != new.ch_addr:
+            self.route_cache.clear()
+        self.refresh_parent_candidate(gui)
+    
+    def on_multihop_change(self, gui, old, new):
+        """Flush route cache when a 2-hop neighbor appears, disappears or changes its address or via node"""
+        if old is None or new is None or old.get('addr') != new.get('addr') or old.get('via') != new.get('via'):
+            self.route_cache.clear()
     
+    def on_child_networks_change(self, gui, old, new):
+        """Flush route cache when child networks change"""
+        self.route_cache.clear()
 
     ###################
     def send_network_request(self):
@@ -795,7 +1238,7 @@ class SensorNode(wsn.Node):
         if self.parent_gui not in self.neighbors_table:
             return
         
-        parent_ch_addr = self.neighbors_table[self.parent_gui].get('ch_addr')
+        parent_ch_addr = self.neighbors_table[self.parent_gui].ch_addr
         if not parent_ch_addr:
             return
         
@@ -830,10 +1273,10 @@ class SensorNode(wsn.Node):
         for gui, info in self.neighbors_table.items():
             neighbors_to_share.append({
                 'gui': gui,
-                'addr': info.get('addr'),
-                'role': info.get('role'),
-                'hop_count': info.get('hop_count'),
-                'distance': info.get('distance', 999)
+                'addr': info.addr,
+                'role': info.role,
+                'hop_count': info.hop_count,
+                'distance': 999 if info.distance is None else info.distance
             })
         
         # Broadcast neighbor table
@@ -886,6 +1329,7 @@ class SensorNode(wsn.Node):
                 'role': neighbor_info.get('role'),
                 'last_seen': self.now
             }
+            self.multihop_expiry.push(self.now, neighbor_id)
         
         if len(neighbors) > 0:
             self.log(f"[MultiHop] Learned {len(neighbors)} 2-hop neighbors via {sender_id}")
@@ -899,23 +1343,14 @@ class SensorNode(wsn.Node):
         Returns:
 
         """
-        # Energy Model: Check if node is alive
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'is_alive') and not self.is_alive:
-            return  # Dead nodes can't receive
-        
-        # Energy Model: Update idle energy before RX
         if ENABLE_ENERGY_MODEL:
-            self.update_idle_energy()
-        
-        # Energy Model: Calculate RX energy
-        if ENABLE_ENERGY_MODEL and hasattr(self, 'bytes_received'):
-            packet_size = self.calculate_packet_size(pck)
-            rx_energy = packet_size * RX_ENERGY_PER_BYTE
-            self.consume_energy(rx_energy, 'RX')
-            self.bytes_received += packet_size
-            self.packets_received += 1
-            rx_time = packet_size / 250000  # 250 kbps data rate
-            self.time_in_rx += rx_time
+            # Energy Model: Check if node is alive
+            if not ENERGY.alive[self.id]:
+                return  # Dead nodes can't receive
+            
+            # Energy Model: the kernel reported the RX burst before delivering
+            if ENERGY.depleted(self.id, self.now):
+                self.die_from_energy_depletion()
         
         # Multi-Hop: Process neighbor table sharing
         if pck.get('type') == 'NEIGHBOR_SHARE':
@@ -939,10 +1374,10 @@ class SensorNode(wsn.Node):
         # CTM-AdHoc: Update neighbor info on ANY packet reception (not just heartbeats)
         if 'gui' in pck and pck['gui'] != self.id:
             if pck['gui'] in self.neighbors_table:
-                self.neighbor_last_seen[pck['gui']] = self.now
+                self.touch_neighbor(pck['gui'])
         
         if self.role in [Roles.ROOT, Roles.CLUSTER_HEAD, Roles.ROUTER]:
-            if 'next_hop' in pck.keys() and pck['dest'] != self.addr:
+            if 'next_hop' in pck and pck['dest'] != self.addr:
                 if self.role == Roles.ROUTER or pck['dest'] != self.ch_addr:
                     self.route_and_forward_package(pck)
                     return
@@ -965,7 +1400,7 @@ class SensorNode(wsn.Node):
                 
                 # Populate members_table (but NOT if yellow is already a CH!)
                 # Check if yellow is a CH before adding
-                yellow_node = next((n for n in sim.nodes if n.id == yellow_id), None)
+                yellow_node = sim.get_node(yellow_id)
                 if yellow_node and hasattr(yellow_node, 'role'):
                     if yellow_node.role == Roles.CLUSTER_HEAD:
                         self.log(f"[CH] WARNING: Yellow {yellow_id} is already a CH, NOT adding to members_table")
@@ -990,7 +1425,7 @@ class SensorNode(wsn.Node):
                         self.child_networks_table[child_ch_id] = []
                     
                     if child_network_id not in self.child_networks_table[child_ch_id]:
-                        self.child_networks_table[child_ch_id].append(child_network_id)
+                        self.child_networks_table[child_ch_id] = self.child_networks_table[child_ch_id] + [child_network_id]
                         self.log(f"[CH] Added child CH {child_ch_id} (network {child_network_id}) via router {router_id}")
             
             if pck['type'] == 'NETWORK_REQUEST':  # it sends a network reply to requested node
@@ -1050,7 +1485,7 @@ class SensorNode(wsn.Node):
                         self.child_networks_table[yellow_id] = []
                     new_network_id = yellow_id  # Network ID is same as CH ID
                     if new_network_id not in self.child_networks_table[yellow_id]:
-                        self.child_networks_table[yellow_id].append(new_network_id)
+                        self.child_networks_table[yellow_id] = self.child_networks_table[yellow_id] + [new_network_id]
                         self.log(f"[CH] Pre-added child CH {yellow_id} with network {new_network_id}")
                 return
 
@@ -1079,7 +1514,7 @@ class SensorNode(wsn.Node):
                 # Calculate distance to yellow
                 parent_addr = None
                 if self.parent_gui is not None and self.parent_gui in self.neighbors_table:
-                    parent_addr = self.neighbors_table[self.parent_gui].get('ch_addr') or self.neighbors_table[self.parent_gui].get('addr')
+                    parent_addr = self.neighbors_table[self.parent_gui].ch_addr or self.neighbors_table[self.parent_gui].addr
                 elif self.ch_addr is not None:
                     parent_addr = self.ch_addr
                 
@@ -1166,23 +1601,14 @@ class SensorNode(wsn.Node):
                 # Check if any connected CH has space (based on MIN_CLUSTER_SIZE)
                 has_space = False
                 for ch_item in self.connected_CHs:
-                    # Check if this CH has space
-                    for node in sim.nodes:
-                        # Compare by node ID
-                        node_matches = False
-                        if isinstance(ch_item, int):
-                            node_matches = (node.id == ch_item)
-                        elif hasattr(ch_item, 'node_addr'):
-                            node_matches = (node.id == ch_item.node_addr)
-                        
-                        if node_matches and hasattr(node, 'cluster_size'):
-                            # CH has space if under MIN_CLUSTER_SIZE (still forming)
-                            if node.cluster_size < MIN_CLUSTER_SIZE:
-                                has_space = True
-                                self.log(f"[ROUTER] CH {node.id} has space ({node.cluster_size}/{MIN_CLUSTER_SIZE} min)")
-                                break
-                    if has_space:
-                        break
+                    # Check if this CH has space (connected_CHs holds node IDs or addresses)
+                    node = sim.get_node(ch_item if isinstance(ch_item, int) else getattr(ch_item, 'node_addr', None))
+                    if node and hasattr(node, 'cluster_size'):
+                        # CH has space if under MIN_CLUSTER_SIZE (still forming)
+                        if node.cluster_size < MIN_CLUSTER_SIZE:
+                            has_space = True
+                            self.log(f"[ROUTER] CH {node.id} has space ({node.cluster_size}/{MIN_CLUSTER_SIZE} min)")
+                            break
                 
                 if has_space:
                     # At least one connected CH has space - ignore request
@@ -1195,7 +1621,7 @@ class SensorNode(wsn.Node):
                     # Forward to parent with router_id marker
                     parent_addr = None
                     if self.parent_gui is not None and self.parent_gui in self.neighbors_table:
-                        parent_addr = self.neighbors_table[self.parent_gui].get('ch_addr') or self.neighbors_table[self.parent_gui].get('addr')
+                        parent_addr = self.neighbors_table[self.parent_gui].ch_addr or self.neighbors_table[self.parent_gui].addr
                     elif self.ch_addr is not None:
                         parent_addr = self.ch_addr
                     
@@ -1276,13 +1702,10 @@ class SensorNode(wsn.Node):
                 if pck['dest_gui'] == self.id:
                     # VALIDATION: Check if sender is a ROUTER (invalid - greens should only join CHs)
                     sender_gui = pck['gui']
-                    sender_is_router = False
-                    for node in sim.nodes:
-                        if node.id == sender_gui and hasattr(node, 'role'):
-                            if node.role == Roles.ROUTER:
-                                sender_is_router = True
-                                self.log(f"[JOIN] REJECTED JOIN_REPLY from ROUTER {sender_gui} - greens cannot join routers!")
-                                break
+                    sender = sim.get_node(sender_gui)
+                    sender_is_router = getattr(sender, 'role', None) == Roles.ROUTER
+                    if sender_is_router:
+                        self.log(f"[JOIN] REJECTED JOIN_REPLY from ROUTER {sender_gui} - greens cannot join routers!")
                     
                     # Reject JOIN_REPLY from routers
                     if sender_is_router:
@@ -1389,10 +1812,10 @@ class SensorNode(wsn.Node):
                 if len(self.neighbors_table) > 0:
                     # Find a registered neighbor to get root address
                     for gui, info in self.neighbors_table.items():
-                        if info.get('role') in [Roles.REGISTERED, Roles.CLUSTER_HEAD, Roles.ROOT]:
+                        if info.role in [Roles.REGISTERED, Roles.CLUSTER_HEAD, Roles.ROOT]:
                             # Temporarily set parent to send network request
                             self.parent_gui = gui
-                            self.root_addr = info.get('root_addr')
+                            self.root_addr = info.root_addr
                             if self.root_addr:
                                 self.addr = wsn.Addr(gui, self.id)  # Temporary address
                                 self.send_network_request()
@@ -1423,15 +1846,12 @@ class SensorNode(wsn.Node):
     ###################
     def is_node_registered(self, node_id):
         """Check if a node is still REGISTERED (not promoted to router/CH)"""
-        for node in sim.nodes:
-            if node.id == node_id:
-                return hasattr(node, 'role') and node.role == Roles.REGISTERED
-        return False
+        return getattr(sim.get_node(node_id), 'role', None) == Roles.REGISTERED
 
     ###################
     def run_network_maintenance(self):
         """
-        Network maintenance
+        Network maintenance, acting on the violation sets kept by INVARIANTS
         - Kill stuck yellow/green pairs that are in infinite retry loops
         - Demote orphaned routers that aren't bridging any CHs
         - Clean up invalid entries in tables
@@ -1447,10 +1867,10 @@ class SensorNode(wsn.Node):
         
         # Diagnostic: Log all registered nodes and their parents
         self.log(f"[MAINTENANCE] Diagnostic: Current registered nodes and their parents:")
-        for green in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.REGISTERED]:
+        for green in sim.nodes_with_role(Roles.REGISTERED):
             parent_info = "None"
             if hasattr(green, 'parent_gui') and green.parent_gui is not None:
-                parent = next((n for n in sim.nodes if n.id == green.parent_gui), None)
+                parent = sim.get_node(green.parent_gui)
                 if parent and hasattr(parent, 'role'):
                     parent_info = f"{green.parent_gui} ({parent.role.name})"
                 else:
@@ -1461,7 +1881,7 @@ class SensorNode(wsn.Node):
         # Phase 1: Find and kill stuck yellows (any yellow stuck > 1000s)
         self.log(f"[MAINTENANCE] Phase 1: Identifying stuck yellows...")
         
-        for yellow in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.UNREGISTERED]:
+        for yellow in sim.nodes_with_role(Roles.UNREGISTERED):
             # Check if yellow has been stuck for > 1000 seconds
             if hasattr(yellow, 'unregistered_since') and yellow.unregistered_since:
                 stuck_time = now - yellow.unregistered_since
@@ -1483,49 +1903,40 @@ class SensorNode(wsn.Node):
         # Phase 1b: Find and kill greens outside network (no parent)
         self.log(f"\n[MAINTENANCE] Phase 1b: Identifying greens outside network...")
         
-        for green in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.REGISTERED]:
-            # Check if green is outside network (no parent CH)
-            if hasattr(green, 'parent_gui') and green.parent_gui is None:
-                self.log(f"[MAINTENANCE] Found green {green.id} outside network (no parent)")
-                killed_greens.append(green.id)
-                
-                # Mark node as killed
-                green.set_role(Roles.UNDISCOVERED)
-                
-                # Stop timers
-                green.kill_timer('TIMER_HEART_BEAT')
-                
-                self.log(f"[MAINTENANCE] Killed green {green.id} (outside network)")
+        for green in INVARIANTS.violating('green_without_parent'):
+            self.log(f"[MAINTENANCE] Found green {green.id} outside network (no parent)")
+            killed_greens.append(green.id)
+            
+            # Mark node as killed
+            green.set_role(Roles.UNDISCOVERED)
+            
+            # Stop timers
+            green.kill_timer('TIMER_HEART_BEAT')
+            
+            self.log(f"[MAINTENANCE] Killed green {green.id} (outside network)")
         
         # Phase 1c: Find and kill greens connected to routers (orphaned greens)
         self.log(f"\n[MAINTENANCE] Phase 1c: Identifying greens connected to routers...")
         
-        for green in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.REGISTERED]:
-            should_kill = False
-            router_id = None
-            
+        # Method 2 candidates: greens whose ch_addr is a router's address and which the router sees as neighbor
+        via_router_addr = {}
+        for router in sim.nodes_with_role(Roles.ROUTER):
+            for green in sim.addr_index.get(router.addr, ()):
+                if green.role == Roles.REGISTERED and green.ch_addr == router.addr and green.id in router.neighbors_table:
+                    via_router_addr.setdefault(green, router.id)  # routers are in id order, first match wins
+        
+        for green in sorted(set(INVARIANTS.violating('green_under_router')) | via_router_addr.keys()):
             # Method 1: Check if green's parent_gui is a ROUTER
-            if hasattr(green, 'parent_gui') and green.parent_gui is not None:
-                parent = next((n for n in sim.nodes if n.id == green.parent_gui), None)
-                if parent and hasattr(parent, 'role') and parent.role == Roles.ROUTER:
-                    should_kill = True
-                    router_id = parent.id
-                    self.log(f"[MAINTENANCE] Found green {green.id} with parent_gui={router_id} (ROUTER)")
+            if green_under_router(green):
+                router_id = green.parent_gui
+                self.log(f"[MAINTENANCE] Found green {green.id} with parent_gui={router_id} (ROUTER)")
             
             # Method 2: Check if green is in any router's members (shouldn't be)
-            if not should_kill:
-                for router in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.ROUTER]:
-                    # Check if this green is connected to this router
-                    if hasattr(router, 'neighbors_table') and green.id in router.neighbors_table:
-                        # Check if green considers router as parent
-                        if hasattr(green, 'ch_addr') and hasattr(router, 'addr'):
-                            if green.ch_addr == router.addr:
-                                should_kill = True
-                                router_id = router.id
-                                self.log(f"[MAINTENANCE] Found green {green.id} with ch_addr pointing to router {router_id}")
-                                break
+            else:
+                router_id = via_router_addr[green]
+                self.log(f"[MAINTENANCE] Found green {green.id} with ch_addr pointing to router {router_id}")
             
-            if should_kill and green.id not in killed_greens:
+            if green.id not in killed_greens:
                 killed_greens.append(green.id)
                 
                 # Mark node as killed
@@ -1539,76 +1950,58 @@ class SensorNode(wsn.Node):
         #  Find and kill greens connected to other greens (invalid green-to-green)
         self.log(f"\n[MAINTENANCE] Phase 1d: Identifying greens connected to other greens...")
         
-        for green in [n for n in sim.nodes if hasattr(n, 'role') and n.role == Roles.REGISTERED]:
-            # Check if green's parent is another REGISTERED node (not a CH)
-            if hasattr(green, 'parent_gui') and green.parent_gui is not None:
-                parent = next((n for n in sim.nodes if n.id == green.parent_gui), None)
-                if parent and hasattr(parent, 'role') and parent.role == Roles.REGISTERED:
-                    # Green is connected to another green - this is invalid
-                    # Greens should only connect to CHs, not other greens
-                    self.log(f"[MAINTENANCE] Found green {green.id} connected to green {parent.id}")
-                    
-                    if green.id not in killed_greens:  # Don't double-kill
-                        killed_greens.append(green.id)
-                        
-                        # Mark node as killed
-                        green.set_role(Roles.UNDISCOVERED)
-                        
-                        # Stop timers
-                        green.kill_timer('TIMER_HEART_BEAT')
-                        
-                        self.log(f"[MAINTENANCE] Killed green {green.id} (connected to green)")
+        for green in INVARIANTS.violating('green_under_green'):
+            # Re-check: the parent may have been killed earlier in this phase
+            if not green_under_green(green):
+                continue
+            # Green is connected to another green - this is invalid
+            # Greens should only connect to CHs, not other greens
+            self.log(f"[MAINTENANCE] Found green {green.id} connected to green {green.parent_gui}")
+            
+            if green.id not in killed_greens:  # Don't double-kill
+                killed_greens.append(green.id)
+                
+                # Mark node as killed
+                green.set_role(Roles.UNDISCOVERED)
+                
+                # Stop timers
+                green.kill_timer('TIMER_HEART_BEAT')
+                
+                self.log(f"[MAINTENANCE] Killed green {green.id} (connected to green)")
         
         # Phase 2: Demote orphaned routers
         self.log(f"\n[MAINTENANCE] Phase 2: Identifying orphaned routers...")
         
         killed_orphaned_members = []  # Initialize for Phase 3
         
-        for node in sim.nodes:
-            if hasattr(node, 'role') and node.role == Roles.ROUTER:
-                # Check if router is actually bridging two CHs
-                has_valid_child = False
-                
-                if hasattr(node, 'connected_CHs') and len(node.connected_CHs) > 1:
-                    child_ch_id = node.connected_CHs[1]
-                    
-                    # Verify child is actually a CH
-                    for other in sim.nodes:
-                        if other.id == child_ch_id and hasattr(other, 'role'):
-                            if other.role in [Roles.CLUSTER_HEAD, Roles.ROOT]:
-                                has_valid_child = True
-                                break
-                
-                if not has_valid_child:
-                    # Orphaned router - demote to REGISTERED
-                    self.log(f"[MAINTENANCE] Found orphaned router {node.id} (no child CH)")
-                    demoted_routers.append(node.id)
-                    
-                    # Demote to REGISTERED
-                    node.set_role(Roles.REGISTERED)
-                    if hasattr(node, 'connected_CHs'):
-                        node.connected_CHs = []
-                    
-                    # Stop router heartbeat timer
-                    node.kill_timer('TIMER_ROUTER_HB')
-                    
-                    # Start regular heartbeat
-                    node.set_timer('TIMER_HEART_BEAT', config.HEARTH_BEAT_TIME_INTERVAL)
-                    
-                    self.log(f"[MAINTENANCE] Demoted orphaned router {node.id} to REGISTERED")
+        for node in INVARIANTS.violating('orphaned_router'):
+            # Orphaned router - demote to REGISTERED
+            self.log(f"[MAINTENANCE] Found orphaned router {node.id} (no child CH)")
+            demoted_routers.append(node.id)
+            
+            # Demote to REGISTERED
+            node.set_role(Roles.REGISTERED)
+            node.connected_CHs = []
+            
+            # Stop router heartbeat timer
+            node.kill_timer('TIMER_ROUTER_HB')
+            
+            # Start regular heartbeat
+            node.set_timer('TIMER_HEART_BEAT', config.HEARTH_BEAT_TIME_INTERVAL)
+            
+            self.log(f"[MAINTENANCE] Demoted orphaned router {node.id} to REGISTERED")
         
         # Phase 3: Clean up members_table entries for killed nodes
         self.log(f"\n[MAINTENANCE] Phase 3: Cleaning up tables...")
         
         all_killed = killed_yellows + killed_greens + killed_orphaned_members
-        for node in sim.nodes:
-            if hasattr(node, 'role') and node.role in [Roles.CLUSTER_HEAD, Roles.ROOT]:
-                if hasattr(node, 'members_table'):
-                    original_count = len(node.members_table)
-                    node.members_table = [m for m in node.members_table if m not in all_killed]
-                    removed = original_count - len(node.members_table)
-                    if removed > 0:
-                        self.log(f"[MAINTENANCE] Removed {removed} killed nodes from CH {node.id} members_table")
+        for node in sim.nodes_with_role(Roles.CLUSTER_HEAD, Roles.ROOT):
+            if hasattr(node, 'members_table'):
+                original_count = len(node.members_table)
+                node.members_table = [m for m in node.members_table if m not in all_killed]
+                removed = original_count - len(node.members_table)
+                if removed > 0:
+                    self.log(f"[MAINTENANCE] Removed {removed} killed nodes from CH {node.id} members_table")
         
         # Summary
         self.log(f"\n{'='*70}")
@@ -1626,29 +2019,10 @@ class SensorNode(wsn.Node):
         if not ENABLE_ENERGY_MODEL:
             return
         
-        for node in sim.nodes:
-            if hasattr(node, 'remaining_energy'):
-                # Update idle energy before sampling
-                node.update_idle_energy()
-                
-                sample = {
-                    'timestamp': self.now,
-                    'node_id': node.id,
-                    'role': node.role.name if hasattr(node, 'role') else 'UNKNOWN',
-                    'remaining_energy': node.remaining_energy,
-                    'energy_consumed': node.initial_energy - node.remaining_energy,
-                    'energy_tx': node.energy_tx,
-                    'energy_rx': node.energy_rx,
-                    'energy_idle': node.energy_idle,
-                    'energy_sleep': node.energy_sleep,
-                    'is_alive': node.is_alive,
-                    'packets_sent': node.packets_sent,
-                    'packets_received': node.packets_received,
-                    'packets_lost': node.packets_lost,
-                    'bytes_sent': node.bytes_sent,
-                    'bytes_received': node.bytes_received
-                }
-                ENERGY_SAMPLES.append(sample)
+        # Depletion is checked on send and receive, idle or sleeping nodes are caught here
+        for node_id in ENERGY.depleted_nodes(self.now):
+            sim.nodes[node_id].die_from_energy_depletion()
+        ENERGY_TIMELINE.append(ENERGY.snapshot(self.now, self.sim.elapsed))
 
     ###################
     def finish(self):
@@ -1662,7 +2036,8 @@ class SensorNode(wsn.Node):
             if ENABLE_MULTIHOP_NEIGHBORS:
                 stats_msg += f"MultiHop:{self.routing_stats['multihop_routes']} "
             
-            stats_msg += f"Failures:{self.routing_stats['route_failures']}"
+            stats_msg += f"Failures:{self.routing_stats['route_failures']} "
+            stats_msg += f"CacheHits:{self.route_cache_stats['hits']} CacheMisses:{self.route_cache_stats['misses']}"
             self.log(stats_msg)
         
         # Multi-Hop: Log neighbor discovery stats
@@ -1682,25 +2057,21 @@ def write_child_networks_table_csv(path="child_networks_table.csv"):
         w = csv.writer(f)
         w.writerow(["node_id", "node_role", "child_count", "children"])
         
-        for node in sim.nodes:
-            if hasattr(node, "role") and node.role in [Roles.ROOT, Roles.CLUSTER_HEAD]:
-                if hasattr(node, "child_networks_table") and node.child_networks_table:
-                    # Format children with their networks
-                    children_list = []
-                    for child_gui, child_networks in node.child_networks_table.items():
-                        # Get child node to determine role
-                        child_role = "UNKNOWN"
-                        for n in sim.nodes:
-                            if n.id == child_gui and hasattr(n, 'role'):
-                                child_role = n.role.name
-                                break
-                        # Format: "child_id(role)[net1,net2,...]"
-                        networks_str = ",".join(str(net) for net in child_networks)
-                        children_list.append(f"{child_gui}({child_role})[{networks_str}]")
-                    
-                    children_str = ";".join(children_list)
-                    child_count = len(node.child_networks_table)
-                    w.writerow([node.id, node.role.name, child_count, children_str])
+        for node in sim.nodes_with_role(Roles.ROOT, Roles.CLUSTER_HEAD):
+            if hasattr(node, "child_networks_table") and node.child_networks_table:
+                # Format children with their networks
+                children_list = []
+                for child_gui, child_networks in node.child_networks_table.items():
+                    # Get child node to determine role
+                    child_node = sim.get_node(child_gui)
+                    child_role = child_node.role.name if hasattr(child_node, 'role') else "UNKNOWN"
+                    # Format: "child_id(role)[net1,net2,...]"
+                    networks_str = ",".join(str(net) for net in child_networks)
+                    children_list.append(f"{child_gui}({child_role})[{networks_str}]")
+                
+                children_str = ";".join(children_list)
+                child_count = len(node.child_networks_table)
+                w.writerow([node.id, node.role.name, child_count, children_str])
 
 
 def write_members_table_csv(path="members_table.csv"):
@@ -1709,23 +2080,19 @@ def write_members_table_csv(path="members_table.csv"):
         w = csv.writer(f)
         w.writerow(["node_id", "node_role", "member_count", "members"])
         
-        for node in sim.nodes:
-            if hasattr(node, "role") and node.role in [Roles.ROOT, Roles.CLUSTER_HEAD]:
-                if hasattr(node, "members_table") and node.members_table:  # Check if not empty
-                    # Format members
-                    members_list = []
-                    for member_gui in node.members_table:
-                        # Get member node to determine role
-                        member_role = "UNKNOWN"
-                        for n in sim.nodes:
-                            if n.id == member_gui and hasattr(n, 'role'):
-                                member_role = n.role.name
-                                break
-                        members_list.append(f"{member_gui}({member_role})")
-                    
-                    members_str = ";".join(members_list)
-                    member_count = len(node.members_table)
-                    w.writerow([node.id, node.role.name, member_count, members_str])
+        for node in sim.nodes_with_role(Roles.ROOT, Roles.CLUSTER_HEAD):
+            if hasattr(node, "members_table") and node.members_table:  # Check if not empty
+                # Format members
+                members_list = []
+                for member_gui in node.members_table:
+                    # Get member node to determine role
+                    member_node = sim.get_node(member_gui)
+                    member_role = member_node.role.name if hasattr(member_node, 'role') else "UNKNOWN"
+                    members_list.append(f"{member_gui}({member_role})")
+                
+                members_str = ";".join(members_list)
+                member_count = len(node.members_table)
+                w.writerow([node.id, node.role.name, member_count, members_str])
 
 
 def write_neighbors_table_csv(path="neighbors_table.csv"):
@@ -1739,10 +2106,10 @@ def write_neighbors_table_csv(path="neighbors_table.csv"):
                 # Format neighbors with role, hop count, and distance
                 neighbors_list = []
                 for neighbor_gui, neighbor_info in node.neighbors_table.items():
-                    role = neighbor_info.get('role')
+                    role = neighbor_info.role
                     role_name = role.name if hasattr(role, 'name') else str(role)
-                    hop_count = neighbor_info.get('hop_count', '?')
-                    distance = neighbor_info.get('distance', 0)
+                    hop_count = '?' if neighbor_info.hop_count is None else neighbor_info.hop_count
+                    distance = 0 if neighbor_info.distance is None else neighbor_info.distance
                     neighbors_list.append(f"{neighbor_gui}({role_name},{hop_count},{distance:.1f})")
                 
                 neighbors_str = ";".join(neighbors_list)
@@ -1753,7 +2120,7 @@ def write_neighbors_table_csv(path="neighbors_table.csv"):
 
 def write_energy_timeline_csv(path="energy_timeline.csv"):
     """Export energy timeline data for plotting"""
-    if not ENABLE_ENERGY_MODEL or not ENERGY_SAMPLES:
+    if not ENABLE_ENERGY_MODEL or not len(ENERGY_TIMELINE):
         return
     
     with open(path, "w", newline="") as f:
@@ -1765,24 +2132,10 @@ def write_energy_timeline_csv(path="energy_timeline.csv"):
             "bytes_sent", "bytes_received"
         ])
         
-        for sample in ENERGY_SAMPLES:
-            w.writerow([
-                sample['timestamp'],
-                sample['node_id'],
-                sample['role'],
-                sample['remaining_energy'],
-                sample['energy_consumed'],
-                sample['energy_tx'],
-                sample['energy_rx'],
-                sample['energy_idle'],
-                sample['energy_sleep'],
-                sample['is_alive'],
-                sample['packets_sent'],
-                sample['packets_received'],
-                sample['packets_lost'],
-                sample['bytes_sent'],
-                sample['bytes_received']
-            ])
+        for chunk in ENERGY_TIMELINE.iter_chunks():
+            columns = [chunk[name].tolist() for name, _ in EnergyTimeline.COLUMNS]
+            columns[2] = [ROLE_NAMES[role] for role in columns[2]]
+            w.writerows(zip(*columns))
 
 
 def write_energy_summary_csv(path="energy_summary.csv"):
@@ -1800,37 +2153,29 @@ def write_energy_summary_csv(path="energy_summary.csv"):
             "bytes_sent", "bytes_received", "is_alive", "death_time"
         ])
         
-        for node in sim.nodes:
-            if hasattr(node, 'remaining_energy'):
-                # Update final idle energy
-                node.update_idle_energy()
-                
-                death_time = ''
-                if hasattr(node, 'is_alive') and not node.is_alive:
-                    death_time = node.now
-                
-                w.writerow([
-                    node.id,
-                    node.role.name if hasattr(node, 'role') else 'UNKNOWN',
-                    node.initial_energy,
-                    node.remaining_energy,
-                    node.initial_energy - node.remaining_energy,
-                    node.energy_tx,
-                    node.energy_rx,
-                    node.energy_idle,
-                    node.energy_sleep,
-                    node.time_in_tx,
-                    node.time_in_rx,
-                    node.time_in_idle,
-                    node.time_in_sleep,
-                    node.packets_sent,
-                    node.packets_received,
-                    node.packets_lost,
-                    node.bytes_sent,
-                    node.bytes_received,
-                    node.is_alive,
-                    death_time
-                ])
+        final = ENERGY.snapshot(sim.now)
+        columns = [final[name].tolist() for name in (
+            'initial_energy', 'remaining_energy', 'energy_consumed', 'energy_tx', 'energy_rx', 'energy_idle',
+            'energy_sleep', 'time_tx', 'time_rx', 'time_idle', 'time_sleep', 'packets_sent', 'packets_received',
+            'packets_lost', 'bytes_sent', 'bytes_received', 'is_alive')]
+        death_times = ['' if math.isnan(t) else t for t in final['death_time'].tolist()]
+        for node_id, values in enumerate(zip(*columns)):
+            node = sim.nodes[node_id]
+            role_name = node.role.name if hasattr(node, 'role') else 'UNKNOWN'
+            w.writerow([node_id, role_name, *values, death_times[node_id]])
+
+
+def write_network_lifetime_csv(path="network_lifetime.csv"):
+    """Export time each network lifetime metric is reached at (empty if it is not reached)"""
+    if not ENABLE_ENERGY_MODEL:
+        return
+    
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["metric", "time", "stopped_simulation"])
+        for name, reached_at in sim.lifetime.times.items():
+            w.writerow([name, '' if reached_at is None else reached_at,
+                        reached_at is not None and name == sim.lifetime.stop])
 
 
 def write_join_times_csv(path="join_times.csv"):
@@ -1872,17 +2217,23 @@ def create_network(node_class, number_of_nodes=100):
     edge = math.ceil(math.sqrt(number_of_nodes))
     startup_delay = getattr(config, 'NODE_STARTUP_DELAY', 5)
     
+    positions = []
+    arrivals = []
     for i in range(number_of_nodes):
         x = i / edge
         y = i % edge
         px = 300 + config.SCALE*x * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
         py = 200 + config.SCALE* y * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
-        node = sim.add_node(node_class, (px, py))
-        NODE_POS[node.id] = (px, py)
-        node.tx_range = config.NODE_TX_RANGE * config.SCALE
-        node.logging = True
+        positions.append((px, py))
         # All nodes appear immediately (white), then wake up together after startup_delay
-        node.arrival = startup_delay + random.uniform(0, 2)  # Small variance to prevent exact simultaneity
+        arrivals.append(startup_delay + random.uniform(0, 2))  # Small variance to prevent exact simultaneity
+    
+    # Bulk creation: neighbor lists of all nodes are built at once
+    nodes = sim.add_nodes(node_class, positions, tx_range=config.NODE_TX_RANGE * config.SCALE)
+    for node, arrival in zip(nodes, arrivals):
+        NODE_POS[node.id] = node.pos
+        node.logging = True
+        node.arrival = arrival
         if node.id == ROOT_ID:
             node.arrival = startup_delay  # Root starts first
 
@@ -1893,6 +2244,12 @@ sim = wsn.Simulator(
     visual=config.SIM_VISUALIZATION,
     terrain_size=config.SIM_TERRAIN_SIZE,
     title=config.SIM_TITLE)
+if ENABLE_ENERGY_MODEL:
+    sim.radio = ENERGY  # nodes report radio states and TX/RX to the energy ledger
+    sim.lifetime = wsn.LifetimeMonitor(sim, LIFETIME_DEAD_PERCENTS, LIFETIME_STOP if ENABLE_LIFETIME_MODE else None)
+    if ENABLE_FAST_FORWARD:
+        sim.fast_forward = wsn.FastForward(sim, FAST_FORWARD_WINDOW, FAST_FORWARD_TOLERANCE, FAST_FORWARD_GUARD,
+                                           ENERGY.remaining_energies)
 
 # creating random network
 create_network(SensorNode, config.SIM_NODE_COUNT)
@@ -1941,15 +2298,22 @@ def export_final_stats():
         if ENABLE_ENERGY_MODEL:
             write_energy_timeline_csv("energy_timeline.csv")
             write_energy_summary_csv("energy_summary.csv")
+            write_network_lifetime_csv("network_lifetime.csv")
             print("Exported: energy_timeline.csv")
             print("Exported: energy_summary.csv")
+            print("Exported: network_lifetime.csv")
             
             # Print energy statistics
-            alive_nodes = sum(1 for node in sim.nodes if hasattr(node, 'is_alive') and node.is_alive)
+            alive_nodes = sum(ENERGY.alive)
             total_nodes = len(sim.nodes)
             print(f"\nEnergy Statistics:")
             print(f"  Alive nodes: {alive_nodes}/{total_nodes} ({alive_nodes/total_nodes*100:.1f}%)")
-            print(f"  Energy samples collected: {len(ENERGY_SAMPLES)}")
+            print(f"  Energy samples collected: {len(ENERGY_TIMELINE)}")
+            if ENABLE_FAST_FORWARD:
+                print(f"  Fast forwarded: {sim.fast_forwarded:.2f}s in {len(sim.fast_forward.jumps)} skips")
+            print(f"  Network lifetime:")
+            for name, reached_at in sim.lifetime.times.items():
+                print(f"    {name}: {'not reached' if reached_at is None else f'{reached_at:.2f}s'}")
           
     except Exception as e:
         print(f"Error exporting tables: {e}")
@@ -2004,9 +2368,10 @@ try:
     print("=" * 80)
     sim.run()
     print("\nSimulation completed!")
-    import time
-    while True:
-        time.sleep(1)
+    if config.SIM_VISUALIZATION:  # keep the window open, headless runs exit and export stats at exit
+        import time
+        while True:
+            time.sleep(1)
 except KeyboardInterrupt:
     export_final_stats()
     print("\nSimulation stopped by user (Ctrl+C)")
@@ -10,6 +10,15 @@ from source import config
 Roles = Enum('Roles', 'UNDISCOVERED UNREGISTERED ROOT REGISTERED CLUSTER_HEAD')
 """Enumeration of roles"""
 
+ENABLE_ENERGY_MODEL = getattr(config, 'ENABLE_ENERGY_MODEL', False)
+INITIAL_ENERGY_JOULES = getattr(config, 'INITIAL_ENERGY_JOULES', 10000)
+PACKET_SIZE = getattr(config, 'REPAIRING_PACKET_SIZE', 50)
+RADIO = wsn.RadioEnergy(getattr(config, 'TX_ENERGY_PER_BYTE', 0.0001), getattr(config, 'RX_ENERGY_PER_BYTE', 0.00005),
+                        getattr(config, 'IDLE_ENERGY_PER_SECOND', 0.00001),
+                        getattr(config, 'SLEEP_ENERGY_PER_SECOND', 0.000001),
+                        size_of=lambda pck: PACKET_SIZE)
+"""Radio energy accountant of all nodes, attached to the simulator when energy model is enabled"""
+
 ###########################################################
 class SensorNode(wsn.Node):
     """SensorNode class is inherited from Node class in wsnlab.py.
@@ -21,6 +30,7 @@ class SensorNode(wsn.Node):
         c_probe (int): probe message counter
         th_probe (int): probe message threshold
         neighbors_table (Dict): keeps the neighbor information with received heart beat messages
+        candidate_parents_table (PriorityIndex): candidate parent guis ordered by their hop count
     """
 
     ###################
@@ -45,7 +55,7 @@ class SensorNode(wsn.Node):
         self.th_probe = 10  # th means threshold and probe is the name of threshold
         self.hop_count = 99999
         self.neighbors_table = {}  # keeps neighbor information with received HB messages
-        self.candidate_parents_table = []
+        self.candidate_parents_table = wsn.PriorityIndex()
         self.child_networks_table = {}
         self.members_table = []
         self.received_JR_guis = []  # keeps received Join Request global unique ids
@@ -89,7 +99,7 @@ class SensorNode(wsn.Node):
         self.th_probe = 10
         self.hop_count = 99999
         self.neighbors_table = {}
-        self.candidate_parents_table = []
+        self.candidate_parents_table = wsn.PriorityIndex()
         self.child_networks_table = {}
         self.members_table = []
         self.received_JR_guis = []  # keeps received Join Request global unique ids
@@ -107,9 +117,8 @@ class SensorNode(wsn.Node):
         """
         pck['arrival_time'] = self.now
         self.neighbors_table[pck['gui']] = pck
-        if pck['gui'] not in self.child_networks_table.keys() or pck['gui'] not in self.members_table:
-            if pck['gui'] not in self.candidate_parents_table:
-                self.candidate_parents_table.append(pck['gui'])
+        if pck['gui'] in self.candidate_parents_table or pck['gui'] not in self.child_networks_table.keys() or pck['gui'] not in self.members_table:
+            self.candidate_parents_table.set(pck['gui'], pck['hop_count'])
         if pck['gui'] == self.parent_gui and self.hop_count != pck['hop_count'] + 1:  # if parent's hop count is changed
             self.hop_count = pck['hop_count'] + 1
             self.send_heart_beat()
@@ -135,8 +144,7 @@ class SensorNode(wsn.Node):
                 if gui in self.child_networks_table.keys():
                     del self.child_networks_table[gui]
                     childs_updated = True
-                if gui in self.candidate_parents_table:
-                    self.candidate_parents_table.remove(gui)
+                self.candidate_parents_table.discard(gui)
         for gui in will_be_removed:
             del self.neighbors_table[gui]
         if self.role != Roles.UNREGISTERED:
@@ -158,12 +166,7 @@ class SensorNode(wsn.Node):
         Returns:
 
         """
-        min_hop = 99999
-        min_hop_gui = 99999
-        for gui in self.candidate_parents_table:
-            if self.neighbors_table[gui]['hop_count'] < min_hop or (self.neighbors_table[gui]['hop_count'] == min_hop and gui < min_hop_gui):
-                min_hop = self.neighbors_table[gui]['hop_count']
-                min_hop_gui = gui
+        min_hop, min_hop_gui = self.candidate_parents_table.peek()
         selected_addr = self.neighbors_table[min_hop_gui]['source']
         self.send_join_request(selected_addr)
         self.set_timer('TIMER_JOIN_REQUEST', 5)
@@ -207,7 +210,7 @@ class SensorNode(wsn.Node):
 
         """
         if self.parent_gui in self.candidate_parents_table:
-            self.candidate_parents_table.remove(self.parent_gui)
+            self.candidate_parents_table.discard(self.parent_gui)
             del self.neighbors_table[self.parent_gui]
         if len(self.candidate_parents_table) != 0:
             self.kill_all_timers()
@@ -393,7 +396,7 @@ class SensorNode(wsn.Node):
 
         """
         if self.role == Roles.ROOT or self.role == Roles.CLUSTER_HEAD:  # if the node is root or cluster head
-            if 'next_hop' in pck.keys() and pck['dest'] != self.addr and pck['dest'] != self.ch_addr:  # forwards message if destination is not itself
+            if 'next_hop' in pck and pck['dest'] != self.addr and pck['dest'] != self.ch_addr:  # forwards message if destination is not itself
                 self.route_and_forward_package(pck)
                 return
             if pck['type'] == 'HEART_BEAT':  # updates neighbor information and relations
@@ -548,15 +551,19 @@ def create_network(node_class, number_of_nodes=100):
 
     """
     edge = math.ceil(math.sqrt(number_of_nodes))
+    positions = []
+    arrivals = []
     for i in range(number_of_nodes):
         x = i / edge
         y = i % edge
         px = 50 + x * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
         py = 50 + y * config.SIM_NODE_PLACING_CELL_SIZE + random.uniform(-1 * config.SIM_NODE_PLACING_CELL_SIZE / 3, config.SIM_NODE_PLACING_CELL_SIZE / 3)
-        node = sim.add_node(node_class, (px, py))
-        node.tx_range = config.NODE_TX_RANGE
+        positions.append((px, py))
+        arrivals.append(random.uniform(0, config.NODE_ARRIVAL_MAX))
+    nodes = sim.add_nodes(node_class, positions, tx_range=config.NODE_TX_RANGE)
+    for node, arrival in zip(nodes, arrivals):
         node.logging = True
-        node.arrival = random.uniform(0, config.NODE_ARRIVAL_MAX)
+        node.arrival = arrival
         if node.id == ROOT_ID:
             node.arrival = 0.1
 
@@ -568,12 +575,21 @@ sim = wsn.Simulator(
     terrain_size=config.SIM_TERRAIN_SIZE,
     title=config.SIM_TITLE)
 
+if ENABLE_ENERGY_MODEL:
+    sim.radio = RADIO  # nodes report radio states and TX/RX to the energy accountant
+
 # creating random network
 create_network(SensorNode, config.SIM_NODE_COUNT)
 
 # start the simulation
 sim.run()
 
+if ENABLE_ENERGY_MODEL:
+    consumed = RADIO.energies(sim.now).sum(axis=1)
+    print(f"\nEnergy Statistics:")
+    print(f"  Total consumed: {consumed.sum():.3f} J")
+    print(f"  Max consumed by a node: {consumed.max():.3f} J of {INITIAL_ENERGY_JOULES} J")
+
 # Sleeping or dead nodes are white
 # Activated and undiscovered nodes are red
 # Discovered and unregistered nodes are yellow
@@ -14,10 +14,15 @@ NODE_STARTUP_DELAY = 5  # seconds - delay before all nodes start routing (allows
 SIM_NODE_COUNT = 100  # noce count in simulation
 SIM_NODE_PLACING_CELL_SIZE = 75  # cell size to place one node
 SIM_DURATION = 2000  # simulation Duration in seconds
-SIM_TIME_SCALE = 0.00001  #  The real time dureation of 1 second simualtion time
+SIM_TIME_SCALE = 0.00001  #  The real time dureation of 1 second simualtion time (0 = headless, as fast as possible)
 SIM_TERRAIN_SIZE = (1400, 1400)  #terrain size
 SIM_TITLE = 'Data Collection Tree'  # title of visualization window
 SIM_VISUALIZATION = True  # visualization active
+SIM_DIRECT_DISPATCH = False  # deliver packets and fire timers in one event ordered by priority (faster, changes event order)
+SIM_BATCH_BROADCAST = False  # deliver a package to all receivers in one event (False = one event per receiver)
+SIM_EVENT_BACKEND = 'simpy'  # event core of headless runs: 'simpy', 'heap' or 'calendar' (no wall-clock pacing)
+SIM_CALENDAR_DAY_LENGTH = 0.1  # seconds covered by one calendar queue bucket
+SIM_CALENDAR_DAYS = 2048  # buckets in the calendar window, later events wait in an overflow heap
 SCALE = 1  # scale factor for visualization
 
 
@@ -57,9 +62,19 @@ TX_ENERGY_PER_BYTE = 0.0001            # Energy consumed per byte transmitted (J
 RX_ENERGY_PER_BYTE = 0.00005           # Energy consumed per byte received (J/byte)
 IDLE_ENERGY_PER_SECOND = 0.00001       # Energy consumed per second while idle (J/s)
 SLEEP_ENERGY_PER_SECOND = 0.000001     # Energy consumed per second while sleeping (J/s)
+REPAIRING_PACKET_SIZE = 50             # Bytes per packet for radio energy in repairing_network.py (its packets carry no payload)
 ENABLE_PACKET_LOSS = True              # Enable packet loss simulation
 PACKET_LOSS_PROBABILITY = 0.1          # Probability that a packet is lost during transmission (0.0-1.0)
 ENERGY_SAMPLE_INTERVAL = 100           # Seconds - how often to sample energy state for CSV export
+ENERGY_TIMELINE_CHUNK_ROWS = 65536     # Rows per energy timeline chunk (node samples)
+ENERGY_TIMELINE_SPILL_DIR = None        # Directory to spill full timeline chunks to as .npy files (None: keep in memory)
+LIFETIME_DEAD_PERCENTS = (10, 50)       # Percentages of dead nodes whose times are recorded as lifetime metrics
+ENABLE_LIFETIME_MODE = False            # Stop simulation when LIFETIME_STOP metric is reached (lifetime experiments)
+LIFETIME_STOP = 'first_death'           # 'first_death', 'dead_<p>%' with p in LIFETIME_DEAD_PERCENTS or 'root_disconnected'
+ENABLE_FAST_FORWARD = False             # Skip steady state energy drain analytically between node deaths
+FAST_FORWARD_WINDOW = 1000              # Seconds - window to measure radio usage in (a multiple of periodic intervals)
+FAST_FORWARD_TOLERANCE = 0.1            # Max relative change of a node's energy use between windows in steady state
+FAST_FORWARD_GUARD = 2000               # Seconds - packet level simulation left before the predicted first death
 
 
 # Node Failure Simulation
@@ -2,110 +2,1511 @@
 Based on wsnsimpy library. Timers, Network address and Sleep mode are included by Mustafa Tosun.
 """
 
-import bisect
+import collections
+import functools
+import heapq
 import inspect
+import itertools
+import math
+import operator
 import random
+import sys
+import numpy as np
 import simpy
 from simpy.util import start_delayed
 from source import config
 
 ###########################################################
 class Addr:
-    """Use for a network address which has two parts
+    """Use for a network address which has two parts. Addresses are immutable and interned, creating the same
+    address twice returns the same object. So they can be compared by identity and used as dict keys or set members.
 
        Attributes:
-           f (int): First part of the address.
-           l (int): Last part of the address.
+           net_addr (int): First part of the address.
+           node_addr (int): Last part of the address.
+    """
+    __slots__ = ('net_addr', 'node_addr', '_hash')
+
+    _interned = {}
+    """Dict: Keeps created addresses by (net_addr, node_addr)."""
+
+    ############################
+    def __new__(cls, net_addr, node_addr):
+        """Constructor for Addr class. Returns the existing object if the address was created before.
+
+           Args:
+               net_addr (int): First part of the address.
+               node_addr (int): Last part of the address.
+
+           Returns:
+               Addr: Created or interned Addr object.
+        """
+        key = (net_addr, node_addr)
+        addr = cls._interned.get(key)
+        if addr is None:
+            addr = object.__new__(cls)
+            object.__setattr__(addr, 'net_addr', net_addr)
+            object.__setattr__(addr, 'node_addr', node_addr)
+            object.__setattr__(addr, '_hash', hash(key))
+            cls._interned[key] = addr
+        return addr
+
+    ############################
+    def __setattr__(self, name, value):
+        """Addresses are immutable, because they are shared by interning.
+
+           Args:
+               name (string): Name of attribute.
+               value (Any): Value of attribute.
+
+           Returns:
+
+        """
+        raise AttributeError('Addr objects are immutable')
+
+    ############################
+    def __reduce__(self):
+        """Keeps interning when an address is copied or pickled.
+
+           Args:
+
+           Returns:
+               Tuple: Constructor and its arguments.
+        """
+        return Addr, (self.net_addr, self.node_addr)
+
+    ############################
+    def __repr__(self):
+        """Representation method of Addr.
+
+           Args:
+
+           Returns:
+               string: represents Addr object as a string.
+        """
+        return '[%d,%d]' % (self.net_addr, self.node_addr)
+
+    ############################
+    def __hash__(self):
+        """Hash function for Addr objects, so they can be used in sets and as dict keys.
+
+           Args:
+
+           Returns:
+               int: Hash of (net_addr, node_addr).
+        """
+        return self._hash
+
+    ############################
+    def __eq__(self, other):
+        """ == operator function for Addr objects.
+
+           Args:
+               other (Addr): An Addr object to compare.
+
+           Returns:
+               bool: returns True if the objects are equal, otherwise False.
+        """
+        if self is other:
+            return True
+        if type(other) is not Addr:
+            return NotImplemented
+        return self.net_addr == other.net_addr and self.node_addr == other.node_addr
+
+    ############################
+    def is_equal(self, other):
+        """Comparison function for Addr objects.
+
+           Args:
+               other (Addr): An Addr object to compare.
+
+           Returns:
+               bool: returns True if the objects are equal, otherwise False.
+        """
+        return self is other or (self.net_addr == other.net_addr and self.node_addr == other.node_addr)
+
+    ############################
+    def local_broadcast(self):
+        """Returns local broadcast address of the network of this address.
+
+           Args:
+
+           Returns:
+               Addr: Address with same net_addr and broadcast node_addr.
+        """
+        return Addr(self.net_addr, config.BROADCAST_NODE_ADDR)
+
+
+BROADCAST_ADDR = Addr(config.BROADCAST_NET_ADDR, config.BROADCAST_NODE_ADDR)
+"""Addr: Keeps broadcast address.
+"""
+
+###########################################################
+class Packet:
+    """Package sent between nodes. It is read like a dict. Fields given by the sender are shared by all receivers
+    of a transmission and are not copied. Values written by a receiver are kept in its own local fields, so
+    receivers do not see each other's annotations.
+
+       Attributes:
+           fields (Dict): Fields given by the sender. They are shared and must not be modified.
+           local (Dict): Fields written after the package is sent, None until the first write.
+           kind (string): Interned message type, taken from 'type' field. It can be compared with 'is'.
+           nbytes (int): Cached size of package in bytes, None until it is calculated.
+    """
+    __slots__ = ('fields', 'local', 'kind', 'nbytes')
+
+    ############################
+    def __init__(self, fields):
+        """Constructor for Packet class.
+
+           Args:
+               fields (Dict): Fields of package. The dict is owned by the package after this call.
+
+           Returns:
+               Packet: Created Packet object.
+        """
+        self.fields = fields
+        self.local = None
+        kind = fields.get('type')
+        self.kind = sys.intern(kind) if type(kind) is str else kind
+        self.nbytes = None
+
+    ############################
+    def __repr__(self):
+        """Representation method of Packet.
+
+           Args:
+
+           Returns:
+               string: represents Packet object as a string.
+        """
+        if self.local:
+            return 'Packet(%r)' % {**self.fields, **self.local}
+        return 'Packet(%r)' % self.fields
+
+    ############################
+    def __getitem__(self, key):
+        """Returns value of a field. Local fields hide shared fields with the same name.
+
+           Args:
+               key (string): Name of field.
+
+           Returns:
+               Any: Value of field. KeyError is raised if it does not exist.
+        """
+        local = self.local
+        if local is not None and key in local:
+            return local[key]
+        return self.fields[key]
+
+    ############################
+    def __setitem__(self, key, value):
+        """Writes a field into local fields of package. Shared fields are not modified.
+
+           Args:
+               key (string): Name of field.
+               value (Any): Value of field.
+
+           Returns:
+
+        """
+        if self.local is None:
+            self.local = {}
+        self.local[key] = value
+        if key == 'type':
+            self.kind = sys.intern(value) if type(value) is str else value
+        self.nbytes = None
+
+    ############################
+    def __contains__(self, key):
+        """Checks if package has a field.
+
+           Args:
+               key (string): Name of field.
+
+           Returns:
+               bool: returns True if the field exists.
+        """
+        return key in self.fields or (self.local is not None and key in self.local)
+
+    ############################
+    def get(self, key, default=None):
+        """Returns value of a field or default value if it does not exist.
+
+           Args:
+               key (string): Name of field.
+               default (Any): Value returned when the field does not exist.
+
+           Returns:
+               Any: Value of field.
+        """
+        local = self.local
+        if local is not None and key in local:
+            return local[key]
+        return self.fields.get(key, default)
+
+    ############################
+    def keys(self):
+        """Returns names of all fields.
+
+           Args:
+
+           Returns:
+               List of string: Names of shared and local fields.
+        """
+        if not self.local:
+            return list(self.fields)
+        return list({**self.fields, **self.local})
+
+    ############################
+    def view(self):
+        """Creates a view of package for a receiver. The view shares fields of package without copying them,
+        writes into the view stay in the view.
+
+           Args:
+
+           Returns:
+               Packet: Created view.
+        """
+        view = Packet.__new__(Packet)
+        view.fields = self.fields
+        view.local = None
+        view.kind = self.kind
+        view.nbytes = self.nbytes
+        return view
+
+    ############################
+    def frozen(self):
+        """Returns a package whose fields are all shared fields. Local fields are merged into a new dict,
+        so the package can be sent again without affecting the previous receivers.
+
+           Args:
+
+           Returns:
+               Packet: The package itself if it has no local fields, otherwise a new package.
+        """
+        if not self.local:
+            return self
+        return Packet({**self.fields, **self.local})
+
+
+###########################################################
+def as_packet(pck):
+    """Converts a package given as a dict to a Packet. The dict is copied, so the sender can reuse it.
+
+       Args:
+           pck (Dict or Packet): Package to be converted.
+
+       Returns:
+           Packet: Converted package. Packet objects are returned as they are.
+    """
+    if type(pck) is Packet:
+        return pck
+    return Packet(dict(pck))
+
+
+PRIORITY_URGENT = simpy.events.URGENT
+"""int: Priority of kernel events which must run before anything else at the same time."""
+PRIORITY_NORMAL = simpy.events.NORMAL
+"""int: Priority of plain delayed executions."""
+PRIORITY_RECEIVE = PRIORITY_NORMAL + 1
+"""int: Priority of packet deliveries. Packets are delivered after normal events at the same time."""
+PRIORITY_TIMER = PRIORITY_NORMAL + 2
+"""int: Priority of timers. Timers fire after packets arriving at the same time are delivered."""
+
+RADIO_SLEEP, RADIO_IDLE, RADIO_RX, RADIO_TX, RADIO_OFF = range(5)
+"""int: Radio states of nodes. A radio is OFF when its node is dead, it consumes nothing then."""
+RADIO_STATE_NAMES = ('SLEEP', 'IDLE', 'RX', 'TX', 'OFF')
+
+
+###########################################################
+class ScheduledCall(simpy.events.Event):
+    """Event which calls a plain function when it is processed. It is scheduled with an explicit priority,
+    events at the same time are processed in increasing priority order.
+
+       Attributes:
+           func (Function): Function to call.
+           args (Tuple): Function args.
+           kwargs (Dict): Function key word args.
+    """
+
+    ############################
+    def __init__(self, env, delay, priority, func, args, kwargs):
+        """Constructor for ScheduledCall class. It schedules the event immediately.
+
+           Args:
+               env (Environment): simpy environment.
+               delay (double): Delay duration.
+               priority (int): Priority among events at the same time.
+               func (Function): Function to call.
+               args (Tuple): Function args.
+               kwargs (Dict): Function key word args.
+
+           Returns:
+               ScheduledCall: Created ScheduledCall object.
+        """
+        self.env = env
+        self.callbacks = [self._call]
+        self._value = None
+        self._ok = True
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        env.schedule(self, priority, delay)
+
+    ############################
+    def _call(self, event):
+        """Callback of event. Calls the function.
+
+           Args:
+               event (Event): This event.
+
+           Returns:
+
+        """
+        self.func(*self.args, **self.kwargs)
+
+
+
+###########################################################
+class CalendarQueue:
+    """Calendar queue of (time, priority, seq, ...) entries. Time is split into days of a fixed length and each day
+    in a window of upcoming days has its own small heap, so near-future entries are pushed and popped in amortised
+    constant time. Entries beyond the window wait in an overflow heap and move into their day when the window reaches
+    them. Entries are popped in exactly the same order as a binary heap pops them.
+
+       Attributes:
+           day_length (double): Length of a day in simulation time.
+           days (int): Number of days in the window.
+           buckets (List of List): Heaps of days in the window. Day d is kept in buckets[d % days].
+           overflow (List): Heap of entries beyond the window.
+           today (int): Index of the earliest day in the window.
+           size (int): Number of entries in buckets.
+    """
+
+    ############################
+    def __init__(self, day_length, days):
+        """Constructor for CalendarQueue class.
+
+           Args:
+               day_length (double): Length of a day in simulation time.
+               days (int): Number of days in the window.
+
+           Returns:
+               CalendarQueue: Created CalendarQueue object.
+        """
+        self.day_length = day_length
+        self.days = days
+        self.buckets = [[] for _ in range(days)]
+        self.overflow = []
+        self.today = 0
+        self.size = 0
+
+    ############################
+    def __len__(self):
+        """Gives number of entries.
+
+           Args:
+
+           Returns:
+               int: Number of entries.
+        """
+        return self.size + len(self.overflow)
+
+    ############################
+    def push(self, entry):
+        """Adds an entry.
+
+           Args:
+               entry (Tuple): Entry whose first item is its time.
+
+           Returns:
+
+        """
+        day = int(entry[0] / self.day_length)
+        if day < self.today:
+            self.rewind(day)
+        if day < self.today + self.days:
+            heapq.heappush(self.buckets[day % self.days], entry)
+            self.size += 1
+        else:
+            heapq.heappush(self.overflow, entry)
+
+    ############################
+    def pop(self):
+        """Removes and returns the earliest entry.
+
+           Args:
+
+           Returns:
+               Tuple: Earliest entry. IndexError is raised if the queue is empty.
+        """
+        bucket = self.buckets[self.today % self.days]
+        if bucket:
+            self.size -= 1
+            return heapq.heappop(bucket)
+        if not self.size:
+            if not self.overflow:
+                raise IndexError('pop from empty calendar queue')
+            # nothing in the window, jump to the day of the earliest far entry
+            self.today = int(self.overflow[0][0] / self.day_length)
+            self.refill()
+        buckets = self.buckets
+        days = self.days
+        while True:
+            bucket = buckets[self.today % days]
+            if bucket:
+                self.size -= 1
+                return heapq.heappop(bucket)
+            self.today += 1
+            if self.overflow:
+                self.refill()
+
+    ############################
+    def peek(self):
+        """Gives the earliest entry without removing it. Buckets are only read, no entry is moved.
+
+           Args:
+
+           Returns:
+               Tuple: Earliest entry. IndexError is raised if the queue is empty.
+        """
+        if self.size:
+            buckets = self.buckets
+            days = self.days
+            for day in range(self.today, self.today + days):
+                bucket = buckets[day % days]
+                if bucket:
+                    return bucket[0]
+        if not self.overflow:
+            raise IndexError('peek from empty calendar queue')
+        return self.overflow[0]
+
+    ############################
+    def refill(self):
+        """Moves overflow entries which are in the window into their days.
+
+           Args:
+
+           Returns:
+
+        """
+        overflow = self.overflow
+        limit = self.today + self.days
+        while overflow:
+            day = int(overflow[0][0] / self.day_length)
+            if day >= limit:
+                break
+            heapq.heappush(self.buckets[day % self.days], heapq.heappop(overflow))
+            self.size += 1
+
+    ############################
+    def rewind(self, day):
+        """Moves the window back to an earlier day. All entries are re-bucketed, it is only needed when an entry is
+        pushed before the window after the queue jumped ahead.
+
+           Args:
+               day (int): New first day of the window.
+
+           Returns:
+
+        """
+        for bucket in self.buckets:
+            self.overflow.extend(bucket)
+            bucket.clear()
+        heapq.heapify(self.overflow)
+        self.size = 0
+        self.today = day
+        self.refill()
+
+
+###########################################################
+class RadioEnergy:
+    """Energy accountant of node radios. Nodes report radio state transitions: sleep() and wake_up() switch between
+    SLEEP and IDLE, sending and receiving a package are TX and RX bursts lasting its airtime, after which the radio
+    is back in its listening state. Each transition integrates the time spent since the previous one, so it costs
+    O(1) and energy is exact at any time without polling. Nodes which did not report yet are IDLE since time 0.
+    Per node state is kept in lists, since transitions update single items, and it is read as NumPy arrays.
+
+       Attributes:
+           power (ndarray): Power in J/s per radio state.
+           data_rate (double): Bytes per second, it gives airtime of packages.
+           size_of (Function): Gives the size of a package in bytes.
+           state (List of int): Listening radio state of each node (SLEEP, IDLE or OFF).
+           since (List of double): Time from which the listening state is counted. It is the end of the last burst.
+           time_in (List of List of double): Time in each radio state per node, up to since.
+           bytes_sent, bytes_received, packets_sent, packets_received (List of int): Traffic counters.
+    """
+
+    ############################
+    def __init__(self, tx_per_byte, rx_per_byte, idle_per_second, sleep_per_second, data_rate=250000, size_of=None):
+        """Constructor for RadioEnergy class. Powers of TX and RX are given per byte and converted with data rate.
+
+           Args:
+               tx_per_byte (double): Energy per byte sent in J.
+               rx_per_byte (double): Energy per byte received in J.
+               idle_per_second (double): Power of idle listening in J/s.
+               sleep_per_second (double): Power of sleeping radio in J/s.
+               data_rate (double): Bytes per second.
+               size_of (Function): Gives the size of a package in bytes. Default uses its cached nbytes or 0.
+
+           Returns:
+               RadioEnergy: Created RadioEnergy object.
+        """
+        self.power = np.zeros(len(RADIO_STATE_NAMES))
+        self.power[RADIO_SLEEP] = sleep_per_second
+        self.power[RADIO_IDLE] = idle_per_second
+        self.power[RADIO_RX] = rx_per_byte * data_rate
+        self.power[RADIO_TX] = tx_per_byte * data_rate
+        self.powers = self.power.tolist()
+        self.data_rate = data_rate
+        self.size_of = size_of if size_of is not None else (lambda pck: pck.nbytes or 0)
+        self.state = []
+        self.since = []
+        self.time_in = []
+        self.bytes_sent = []
+        self.bytes_received = []
+        self.packets_sent = []
+        self.packets_received = []
+
+    ############################
+    def __len__(self):
+        """Gives number of accounted nodes.
+
+           Args:
+
+           Returns:
+               int: Number of nodes.
+        """
+        return len(self.state)
+
+    ############################
+    def add_nodes(self, count):
+        """Starts accounting of given number of new nodes. They are IDLE since time 0.
+
+           Args:
+               count (int): Number of nodes.
+
+           Returns:
+
+        """
+        self.state.extend([RADIO_IDLE] * count)
+        self.since.extend([0.0] * count)
+        self.time_in.extend([0.0] * len(RADIO_STATE_NAMES) for _ in range(count))
+        for counters in (self.bytes_sent, self.bytes_received, self.packets_sent, self.packets_received):
+            counters.extend([0] * count)
+
+    ############################
+    def transition(self, node_id, state, now):
+        """Switches listening state of a node's radio. An OFF radio stays off.
+
+           Args:
+               node_id (int): Id of node.
+               state (int): RADIO_SLEEP, RADIO_IDLE or RADIO_OFF.
+               now (double): Time of transition.
+
+           Returns:
+
+        """
+        if node_id >= len(self.state):
+            self.add_nodes(node_id + 1 - len(self.state))
+        current = self.state[node_id]
+        if current == RADIO_OFF:
+            return
+        since = self.since[node_id]
+        if now > since:
+            self.time_in[node_id][current] += now - since
+            self.since[node_id] = now
+        self.state[node_id] = state
+
+    ############################
+    def burst(self, node_id, state, nbytes, now):
+        """Counts a TX or RX burst of given size starting at now, or when the previous burst ends.
+
+           Args:
+               node_id (int): Id of node.
+               state (int): RADIO_TX or RADIO_RX.
+               nbytes (int): Size of package in bytes.
+               now (double): Time of burst.
+
+           Returns:
+               bool: False if the radio is off and nothing is counted.
+        """
+        if node_id >= len(self.state):
+            self.add_nodes(node_id + 1 - len(self.state))
+        current = self.state[node_id]
+        if current == RADIO_OFF:
+            return False
+        times = self.time_in[node_id]
+        since = self.since[node_id]
+        if now > since:
+            times[current] += now - since
+            since = now
+        airtime = nbytes / self.data_rate
+        times[state] += airtime
+        self.since[node_id] = since + airtime
+        if state == RADIO_TX:
+            self.bytes_sent[node_id] += nbytes
+            self.packets_sent[node_id] += 1
+        else:
+            self.bytes_received[node_id] += nbytes
+            self.packets_received[node_id] += 1
+        return True
+
+    ############################
+    def times(self, now):
+        """Gives time spent in each radio state by all nodes up to now.
+
+           Args:
+               now (double): Current time.
+
+           Returns:
+               ndarray: nodes x states array of times.
+        """
+        n = len(self.state)
+        times = np.array(self.time_in, dtype=float).reshape(n, len(RADIO_STATE_NAMES))
+        elapsed = np.maximum(now - np.array(self.since, dtype=float), 0)
+        times[np.arange(n), np.array(self.state, dtype=np.int64)] += elapsed
+        return times
+
+    ############################
+    def energies(self, now):
+        """Gives energy consumed in each radio state by all nodes up to now.
+
+           Args:
+               now (double): Current time.
+
+           Returns:
+               ndarray: nodes x states array of energies in J.
+        """
+        return self.times(now) * self.power
+
+    ############################
+    def add_usage(self, times, counters, now):
+        """Adds radio usage which is not simulated packet by packet, e.g. extrapolated steady state.
+
+           Args:
+               times (ndarray): nodes x states array of time to add to each radio state.
+               counters (ndarray): 4 x nodes array of bytes sent, bytes received, packets sent and packets received.
+               now (double): Time the usage is added at. It is not used here, subclasses keeping state derived from
+                consumed energy (e.g. depletion budgets) settle it at this time.
+
+           Returns:
+
+        """
+        for time_in, added in zip(self.time_in, times.tolist()):
+            for state, t in enumerate(added):
+                time_in[state] += t
+        for values, added in zip((self.bytes_sent, self.bytes_received, self.packets_sent, self.packets_received),
+                                 counters.astype(np.int64).tolist()):
+            for node_id, count in enumerate(added):
+                values[node_id] += count
+
+    ############################
+    def consumed(self, node_id, now):
+        """Gives energy consumed by a node up to now.
+
+           Args:
+               node_id (int): Id of node.
+               now (double): Current time.
+
+           Returns:
+               double: Energy in J.
+        """
+        if node_id >= len(self.state):
+            return 0.0
+        powers = self.powers
+        energy = sum(t * p for t, p in zip(self.time_in[node_id], powers))
+        elapsed = now - self.since[node_id]
+        if elapsed > 0:
+            energy += elapsed * powers[self.state[node_id]]
+        return energy
+
+
+###########################################################
+class LifetimeMonitor:
+    """Records network lifetime metrics as nodes die and stops the simulation when the chosen one is reached.
+    Metrics are the first node death, given percentages of dead nodes and disconnection of the root, which is
+    the death of the root or of all nodes in its range. Each death is checked in O(1), nothing is polled.
+
+       Attributes:
+           sim (Simulator): Simulator to stop.
+           stop (str): Name of metric which stops the simulation. If it is None, simulation runs to its duration.
+           times (Dict): Elapsed time each metric is reached at, None until then. Keys are 'first_death',
+            'dead_<p>%' for each percentage and 'root_disconnected'.
+           dead_percents (List of double): Percentages of dead nodes which are recorded.
+           dead (Set of int): Ids of dead nodes.
+           root (int): Id of root node, None until it is set.
+           root_links (Set of int): Alive nodes in range of root.
+    """
+
+    ############################
+    def __init__(self, sim, dead_percents=(), stop=None):
+        """Constructor for LifetimeMonitor class.
+
+           Args:
+               sim (Simulator): Simulator to stop.
+               dead_percents (List of double): Percentages of dead nodes to record.
+               stop (str): Name of metric which stops the simulation, or None.
+
+           Returns:
+               LifetimeMonitor: Created LifetimeMonitor object.
+        """
+        self.sim = sim
+        self.times = {'first_death': None}
+        for percent in sorted(dead_percents):
+            self.times[f'dead_{percent:g}%'] = None
+        self.times['root_disconnected'] = None
+        if stop is not None and stop not in self.times:
+            raise ValueError(f'unknown lifetime metric {stop!r}, expected one of {list(self.times)}')
+        self.stop = stop
+        self.dead_percents = sorted(dead_percents)
+        self.thresholds = None
+        self.dead = set()
+        self.root = None
+        self.root_links = set()
+
+    ############################
+    def reach(self, name):
+        """Records the first time a metric is reached, and stops the simulation if it is the stop metric.
+
+           Args:
+               name (str): Name of metric.
+
+           Returns:
+
+        """
+        if self.times[name] is not None:
+            return
+        self.times[name] = self.sim.elapsed
+        if name == self.stop:
+            self.sim.stop()
+
+    ############################
+    def set_root(self, node_id):
+        """Sets the root node. Its alive neighbors within its own tx range are tracked for disconnection.
+
+           Args:
+               node_id (int): Id of root node.
+
+           Returns:
+
+        """
+        self.root = node_id
+        # adjacency holds links up to the largest tx range, the root only reaches neighbors within its own
+        neighbors, distances = self.sim.adjacency(node_id)
+        end = np.searchsorted(distances, self.sim.nodes[node_id].tx_range, side='right')
+        self.root_links = set(neighbors[:end].tolist()) - self.dead
+        if node_id in self.dead or not self.root_links:
+            self.reach('root_disconnected')
+
+    ############################
+    def node_died(self, node_id):
+        """Counts death of a node and records metrics it reaches.
+
+           Args:
+               node_id (int): Id of dead node.
+
+           Returns:
+
+        """
+        if node_id in self.dead:
+            return
+        self.dead.add(node_id)
+        if self.thresholds is None:
+            # node count is known once the simulation runs; (count, name) pairs are consumed in order
+            total = len(self.sim.nodes)
+            self.thresholds = [(max(1, math.ceil(p * total / 100)), f'dead_{p:g}%') for p in self.dead_percents]
+            self.thresholds.reverse()
+        self.reach('first_death')
+        while self.thresholds and self.thresholds[-1][0] <= len(self.dead):
+            self.reach(self.thresholds.pop()[1])
+        if self.root is not None:
+            self.root_links.discard(node_id)
+            if node_id == self.root or not self.root_links:
+                self.reach('root_disconnected')
+
+
+###########################################################
+class FastForward:
+    """Skips steady state energy drain analytically. Every window it measures radio usage of all nodes. When no role
+    changed during the last two windows and energy used by each node changed less than the tolerance between
+    them, the network is in a periodic steady state. Usage of that state is then extrapolated up to the guard time
+    before the first node is predicted to run out of energy, added to the radio accountant and counted as elapsed
+    time of simulator. Events are not moved, so protocol timestamps stay valid and packet level simulation resumes
+    from the same state to handle the death and the topology change after it. Skips never go past the duration of
+    simulator. The next measurement is never scheduled past the duration either, and the one due at the duration
+    stops the simulation.
+
+       Attributes:
+           sim (Simulator): Simulator whose radio usage is measured.
+           window (double): Seconds between measurements.
+           tolerance (double): Max relative change of energy used by a node between windows in steady state.
+           guard (double): Seconds of packet level simulation left before the predicted first death.
+           remaining (Function): Gives remaining energy of all nodes as a sequence at a given time, 0 for dead nodes.
+           samples (deque): Last three measurements as (time, radio times, radio counters, role changes).
+           jumps (List of Tuple(double,double)): Simulation time and duration of each skip.
+           last (bool): True if the next measurement is due when elapsed time reaches the duration.
+    """
+
+    ############################
+    def __init__(self, sim, window, tolerance, guard, remaining):
+        """Constructor for FastForward class. It schedules the first measurement.
+
+           Args:
+               sim (Simulator): Simulator with a radio accountant.
+               window (double): Seconds between measurements.
+               tolerance (double): Max relative change of energy used by a node between windows in steady state.
+               guard (double): Seconds of packet level simulation left before the predicted first death.
+               remaining (Function): Gives remaining energy of all nodes as a sequence at a given time.
+
+           Returns:
+               FastForward: Created FastForward object.
+        """
+        self.sim = sim
+        self.window = window
+        self.tolerance = tolerance
+        self.guard = guard
+        self.remaining = remaining
+        self.samples = collections.deque(maxlen=3)
+        self.jumps = []
+        self.last = False
+        sim.schedule(window, PRIORITY_NORMAL, self.measure)
+
+    ############################
+    def measure(self):
+        """Measures radio usage, skips the steady state if it is detected and schedules the next measurement.
+
+           Args:
+
+           Returns:
+
+        """
+        sim, radio = self.sim, self.sim.radio
+        if self.last:
+            sim.stop()  # elapsed time reached the duration, env time is short of it by the skipped time
+            return
+        now = sim.now
+        counters = np.array([radio.bytes_sent, radio.bytes_received, radio.packets_sent, radio.packets_received],
+                            dtype=float)
+        self.samples.append((now, radio.times(now), counters, sim.role_changes))
+        if self.is_steady():
+            self.skip()
+        left = sim.duration - sim.elapsed
+        self.last = left <= self.window
+        sim.schedule(min(self.window, left), PRIORITY_NORMAL, self.measure)
+
+    ############################
+    def is_steady(self):
+        """Checks whether the last two windows are in the same steady state.
+
+           Args:
+
+           Returns:
+               bool: True if roles are stable and energy used by each node changed less than the tolerance.
+        """
+        if len(self.samples) < 3:
+            return False
+        (_, t0, _, r0), (_, t1, _, r1), (_, t2, _, r2) = self.samples
+        if not r0 == r1 == r2 or not t0.shape == t1.shape == t2.shape:
+            return False
+        power = self.sim.radio.power
+        used1 = (t1 - t0) @ power
+        used2 = (t2 - t1) @ power
+        return bool(np.all(np.abs(used2 - used1) <= self.tolerance * np.maximum(used1, used2)))
+
+    ############################
+    def skip(self):
+        """Extrapolates usage of the last two windows up to the guard time before the predicted first death.
+
+           Args:
+
+           Returns:
+
+        """
+        (start, t0, c0, _), _, (now, t2, c2, _) = self.samples
+        span = now - start
+        rates = (t2 - t0) / span
+        power = rates @ self.sim.radio.power
+        remaining = np.asarray(self.remaining(now), dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lifetimes = np.where(power > 0, remaining / power, math.inf)
+        first_death = lifetimes.min() if len(lifetimes) else math.inf
+        if math.isinf(first_death):
+            return  # nothing drains energy
+        sim = self.sim
+        duration = min(first_death - self.guard, sim.duration - sim.elapsed)
+        if not duration >= self.window:
+            return  # next death or end of simulation is near
+        sim.radio.add_usage(rates * duration, np.rint((c2 - c0) * (duration / span)), now)
+        sim.fast_forwarded += duration
+        self.jumps.append((now, duration))
+        self.samples.clear()  # usage is measured again after the skip
+
+
+###########################################################
+class PriorityIndex:
+    """Set of keys ordered by a priority which can change, e.g. candidate parents ordered by hop count.
+    Keys are kept in a binary heap of (priority, key) entries, so the smallest one is found in logarithmic time and
+    ties go to the smaller key. Updated or removed keys leave their old entries in the heap, which are dropped when
+    they reach the top or when they outnumber live keys.
+
+       Attributes:
+           heap (List): Heap of (priority, key) entries, some of them outdated.
+           priorities (Dict): Current priority of each key.
+    """
+    __slots__ = ('heap', 'priorities')
+
+    ############################
+    def __init__(self):
+        """Constructor for PriorityIndex class.
+
+           Args:
+
+           Returns:
+               PriorityIndex: Created PriorityIndex object.
+        """
+        self.heap = []
+        self.priorities = {}
+
+    ############################
+    def __len__(self):
+        """Gives number of keys.
+
+           Args:
+
+           Returns:
+               int: Number of keys.
+        """
+        return len(self.priorities)
+
+    ############################
+    def __contains__(self, key):
+        """Checks if a key is in the index.
+
+           Args:
+               key (Object): Key to check.
+
+           Returns:
+               bool: True if the key is in the index.
+        """
+        return key in self.priorities
+
+    ############################
+    def set(self, key, priority):
+        """Adds key or changes its priority.
+
+           Args:
+               key (Object): Key to add.
+               priority (Object): Priority of key, smaller comes first.
+
+           Returns:
+
+        """
+        if self.priorities.get(key, self) == priority:
+            return
+        self.priorities[key] = priority
+        heapq.heappush(self.heap, (priority, key))
+        if len(self.heap) > 2 * len(self.priorities) + 16:
+            self.heap = [(p, k) for k, p in self.priorities.items()]
+            heapq.heapify(self.heap)
+
+    ############################
+    def discard(self, key):
+        """Removes key if it is present.
+
+           Args:
+               key (Object): Key to remove.
+
+           Returns:
+
+        """
+        self.priorities.pop(key, None)
+
+    ############################
+    def clear(self):
+        """Removes all keys.
+
+           Args:
+
+           Returns:
+
+        """
+        self.heap.clear()
+        self.priorities.clear()
+
+    ############################
+    def peek(self):
+        """Gives key with the smallest priority.
+
+           Args:
+
+           Returns:
+               Tuple: (priority, key) of smallest entry, None if there is no key.
+        """
+        heap = self.heap
+        while heap:
+            priority, key = heap[0]
+            if self.priorities.get(key, self) == priority:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+
+###########################################################
+class HeapEnvironment:
+    """Minimal discrete-event core on a binary heap or on a CalendarQueue. Plain function calls are kept in the queue
+    as tuples without event objects, which makes scheduling and dispatch cheaper than simpy. It has the simpy Environment surface used
+    by wsnlab (now, schedule, timeout, event, process, run), so simpy processes and timeouts still work on it.
+    It has no wall-clock pacing.
+
+       Attributes:
+           now (double): Current simulation time.
+           event_count (int): Number of processed entries.
+    """
+
+    ############################
+    def __init__(self, initial_time=0, queue=None):
+        """Constructor for HeapEnvironment class.
+
+           Args:
+               initial_time (double): Start time of simulation.
+               queue (CalendarQueue): Event queue. If it is None, a binary heap is used.
+
+           Returns:
+               HeapEnvironment: Created HeapEnvironment object.
+        """
+        self.now = initial_time
+        self.event_count = 0
+        if queue is None:
+            queue = []
+            self._push = functools.partial(heapq.heappush, queue)
+            self._pop = functools.partial(heapq.heappop, queue)
+        else:
+            self._push = queue.push
+            self._pop = queue.pop
+        self._queue = queue
+        self._eid = itertools.count()
+        self._active_proc = None
+
+    ############################
+    @property
+    def active_process(self):
+        """Process which is running currently. It is used by simpy processes.
+
+           Args:
+
+           Returns:
+               Process: Running process or None.
+        """
+        return self._active_proc
+
+    ############################
+    def schedule(self, event, priority=PRIORITY_NORMAL, delay=0):
+        """Schedules a simpy event. Its callbacks are called when it is processed.
+
+           Args:
+               event (Event): Event to schedule.
+               priority (int): Priority among events at the same time.
+               delay (double): Delay duration.
+
+           Returns:
+
+        """
+        self._push((self.now + delay, priority, next(self._eid), None, event, None))
+
+    ############################
+    def call(self, delay, priority, func, args, kwargs):
+        """Schedules a plain function call without creating an event.
+
+           Args:
+               delay (double): Delay duration.
+               priority (int): Priority among events at the same time.
+               func (Function): Function to call.
+               args (Tuple): Function args.
+               kwargs (Dict): Function key word args.
+
+           Returns:
+
+        """
+        self._push((self.now + delay, priority, next(self._eid), func, args, kwargs))
+
+    ############################
+    def timeout(self, delay, value=None):
+        """Creates a simpy Timeout event on this environment.
+
+           Args:
+               delay (double): Delay duration.
+               value (Any): Value of event.
+
+           Returns:
+               Timeout: Created event.
+        """
+        return simpy.events.Timeout(self, delay, value)
+
+    ############################
+    def event(self):
+        """Creates a simpy Event on this environment.
+
+           Args:
+
+           Returns:
+               Event: Created event.
+        """
+        return simpy.events.Event(self)
+
+    ############################
+    def process(self, generator):
+        """Starts a simpy Process on this environment.
+
+           Args:
+               generator (Generator): Generator of process.
+
+           Returns:
+               Process: Created process.
+        """
+        return simpy.events.Process(self, generator)
+
+    ############################
+    def peek(self):
+        """Gives time of the next entry.
+
+           Args:
+
+           Returns:
+               double: Time of the next entry, infinity if there is not any.
+        """
+        if not self._queue:
+            return math.inf
+        if type(self._queue) is list:
+            return self._queue[0][0]
+        return self._queue.peek()[0]
+
+    ############################
+    def run(self, until=None):
+        """Processes entries in time and priority order until given time. Like simpy, entries at the stop time
+        are not processed unless they are urgent and scheduled before run() is called. A simpy StopSimulation
+        raised by an entry ends the run at its time.
+
+           Args:
+               until (double): Stop time. If it is None, runs until there is no entry.
+
+           Returns:
+
+        """
+        if until is not None and until <= self.now:
+            raise ValueError(f'until ({until}) must be greater than the current simulation time')
+        stop = (math.inf, 0, 0) if until is None else (until, PRIORITY_URGENT, next(self._eid))
+        pop = self._pop
+        count = 0
+        try:
+            while True:
+                try:
+                    entry = pop()
+                except IndexError:
+                    break
+                if entry[0] >= stop[0] and entry[:3] > stop:
+                    self._push(entry)
+                    break
+                self.now, _, _, func, args, kwargs = entry
+                count += 1
+                if func is not None:
+                    if kwargs:
+                        func(*args, **kwargs)
+                    else:
+                        func(*args)
+                    continue
+                # simpy event: call its callbacks, then crash if it failed and nobody handled it
+                event = args
+                callbacks, event.callbacks = event.callbacks, None
+                for callback in callbacks:
+                    callback(event)
+                if not event._ok and not hasattr(event, '_defused'):
+                    exc = type(event._value)(*event._value.args)
+                    exc.__cause__ = event._value
+                    raise exc
+        except simpy.core.StopSimulation:
+            return  # stopped by Simulator.stop(), time stays at the stop time
+        finally:
+            self.event_count += count
+        if until is not None:
+            self.now = until
+
+
+###########################################################
+class Timer:
+    """Handle of a timer set by a node. Several timers with the same name can be pending at the same time.
+
+       Attributes:
+           node (Node): Owner node of timer.
+           name (string): Name of timer.
+           args (Tuple): Additional args passed to on_timer_fired().
+           kwargs (Dict): Additional key word args passed to on_timer_fired().
+           cancelled (bool): If it is True, timer is killed or already fired. Its event is skipped when it comes due.
+    """
+    __slots__ = ('node', 'name', 'args', 'kwargs', 'cancelled')
+
+    ############################
+    def __init__(self, node, name, args, kwargs):
+        """Constructor for Timer class.
+
+           Args:
+               node (Node): Owner node of timer.
+               name (string): Name of timer.
+               args (Tuple): Additional args.
+               kwargs (Dict): Additional key word args.
+
+           Returns:
+               Timer: Created Timer object.
+        """
+        self.node = node
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    ############################
+    def __repr__(self):
+        """Representation method of Timer.
+
+           Args:
+
+           Returns:
+               string: represents Timer object as a string.
+        """
+        return '<Timer %s of node %d%s>' % (self.name, self.node.id, ' cancelled' if self.cancelled else '')
+
+    ############################
+    def cancel(self):
+        """Cancels timer in O(1). Its scheduled event stays in the event queue and is skipped lazily.
+
+           Args:
+
+           Returns:
+
+        """
+        if not self.cancelled:
+            self.cancelled = True
+            pending = self.node.timers.get(self.name)
+            if pending is not None:
+                pending.pop(self, None)
+                if not pending:
+                    del self.node.timers[self.name]
+
+
+###########################################################
+def ensure_generator(env, func, *args, **kwargs):
+    '''
+    Make sure that func is a generator function.  If it is not, return a
+    generator wrapper
+    '''
+    if inspect.isgeneratorfunction(func):
+        return func(*args, **kwargs)
+    else:
+        def _wrapper():
+            func(*args, **kwargs)
+            yield env.timeout(0)
+
+        return _wrapper()
+
+
+###########################################################
+def deliver_to_all(nodes, pck):
+    """Delivers a package to given nodes in order. It is used as a single event of batched broadcast delivery.
+
+       Args:
+           nodes (List of Node): Receivers sorted by distance to sender.
+           pck (Packet): Package to be delivered. Each node gets its own view of it.
+
+       Returns:
+
+    """
+    for node in nodes:
+        node.deliver(pck.view())
+
+
+###########################################################
+def distance(pos1, pos2):
+    """Calculates the distance between two positions.
+
+       Args:
+           pos1 (Tuple(double,double)): First position.
+           pos2 (Tuple(double,double)): Second position.
+
+       Returns:
+           double: returns the distance between two positions.
+    """
+    return ((pos1[0] - pos2[0]) ** 2 + (pos1[1] - pos2[1]) ** 2) ** 0.5
+
+
+###########################################################
+def in_range_pairs(positions, r):
+    """Finds all ordered pairs of positions within a given distance by a vectorised grid join.
+    Positions are bucketed into cells of size r, so only members of adjacent cells are compared.
+
+       Args:
+           positions (ndarray): Array of positions with shape (N, 2).
+           r (double): Radius.
+
+       Returns:
+           Tuple(ndarray,ndarray,ndarray): Source indexes, neighbor indexes and distances of pairs.
+            Pairs are sorted by source index, then distance, then neighbor index.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    if len(positions) < 2 or r <= 0:
+        return empty
+
+    # bucket positions into cells, keys of neighboring cells differ by -1/0/+1 in each axis
+    cells = np.floor(positions / r).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    stride = cells[:, 1].max() + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    src_parts, dst_parts = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            # pair each occupied cell with its occupied neighbor cell in this direction
+            other_keys = cell_keys + dx * stride + dy
+            found = np.searchsorted(cell_keys, other_keys)
+            found[found == len(cell_keys)] = 0
+            valid = cell_keys[found] == other_keys
+            a = np.nonzero(valid)[0]
+            b = found[valid]
+            sizes = counts[a] * counts[b]
+            if not sizes.sum():
+                continue
+            # expand every cell pair into member pairs
+            pair = np.repeat(np.arange(len(a)), sizes)
+            offset = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            src_parts.append(order[starts[a][pair] + offset // counts[b][pair]])
+            dst_parts.append(order[starts[b][pair] + offset % counts[b][pair]])
+    if not src_parts:
+        return empty
+
+    src = np.concatenate(src_parts)
+    dst = np.concatenate(dst_parts)
+    delta = positions[src] - positions[dst]
+    dist = np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+    keep = (dist <= r) & (src != dst)
+    src, dst, dist = src[keep], dst[keep], dist[keep]
+    sort = np.lexsort((dst, dist, src))
+    return src[sort], dst[sort], dist[sort]
+
+
+###########################################################
+class SpatialGrid:
+    """Uniform grid index over node positions. It is used to find nodes close to a position
+    without scanning every node.
+
+       Attributes:
+           cell_size (double): Edge length of a square cell.
+           cells (Dict): Keeps list of nodes for each (int,int) cell coordinate.
+           node_cells (Dict): Keeps the cell coordinate of each indexed node.
     """
 
     ############################
-    def __init__(self, net_addr, node_addr):
-        """Constructor for Addr class.
+    def __init__(self, cell_size, nodes=()):
+        """Constructor for SpatialGrid class.
 
            Args:
-               f (int): First part of the address.
-               l (int): Last part of the address.
+               cell_size (double): Edge length of a square cell. Using max transmission range keeps queries in 3x3 cells.
+               nodes (List of Node): Nodes to be indexed.
 
            Returns:
-               Addr: Created Addr object.
+               SpatialGrid: Created SpatialGrid object.
         """
-        self.net_addr = net_addr
-        self.node_addr = node_addr
+        self.cell_size = cell_size
+        self.cells = {}
+        self.node_cells = {}
+        for node in nodes:
+            self.add(node)
 
     ############################
-    def __repr__(self):
-        """Representation method of Addr.
+    def cell_of(self, pos):
+        """Finds the cell coordinate of a position.
 
            Args:
+               pos (Tuple(double,double)): Position.
 
            Returns:
-               string: represents Addr object as a string.
+               Tuple(int,int): Cell coordinate.
         """
-        return '[%d,%d]' % (self.net_addr, self.node_addr)
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
 
     ############################
-    def __eq__(self, other):
-        """ == operator function for Addr objects.
+    def add(self, node):
+        """Adds a node to the cell of its current position.
 
            Args:
-               other (Addr): An Addr object to compare.
+               node (Node): Node to be indexed.
 
            Returns:
-               bool: returns True if the objects are equal, otherwise False.
+
         """
-        if self.net_addr == other.net_addr and self.node_addr == other.node_addr:
-            return True
-        return False
+        cell = self.cell_of(node.pos)
+        self.cells.setdefault(cell, []).append(node)
+        self.node_cells[node] = cell
 
     ############################
-    def is_equal(self, other):
-        """Comparison function for Addr objects.
+    def remove(self, node):
+        """Removes a node from the cell it was indexed in.
 
            Args:
-               other (Addr): An Addr object to compare.
+               node (Node): Node to be removed.
 
            Returns:
-               bool: returns True if the objects are equal, otherwise False.
-        """
-        if self.net_addr == other.net_addr and self.node_addr == other.node_addr:
-            return True
-        return False
-
-
-BROADCAST_ADDR = Addr(config.BROADCAST_NET_ADDR, config.BROADCAST_NODE_ADDR)
-"""Addr: Keeps broadcast address.
-"""
 
+        """
+        cell = self.node_cells.pop(node)
+        members = self.cells[cell]
+        members.remove(node)
+        if not members:
+            del self.cells[cell]
 
+    ############################
+    def update(self, node):
+        """Moves a node to the cell of its current position if it is changed.
 
-###########################################################
-def ensure_generator(env, func, *args, **kwargs):
-    '''
-    Make sure that func is a generator function.  If it is not, return a
-    generator wrapper
-    '''
-    if inspect.isgeneratorfunction(func):
-        return func(*args, **kwargs)
-    else:
-        def _wrapper():
-            func(*args, **kwargs)
-            yield env.timeout(0)
+           Args:
+               node (Node): Node which is added or relocated.
 
-        return _wrapper()
+           Returns:
 
+        """
+        if self.node_cells.get(node) != self.cell_of(node.pos):
+            if node in self.node_cells:
+                self.remove(node)
+            self.add(node)
 
-###########################################################
-def distance(pos1, pos2):
-    """Calculates the distance between two positions.
+    ############################
+    def nodes_within(self, pos, r):
+        """Finds indexed nodes within a given distance of a position.
 
-       Args:
-           pos1 (Tuple(double,double)): First position.
-           pos2 (Tuple(double,double)): Second position.
+           Args:
+               pos (Tuple(double,double)): Center position.
+               r (double): Radius.
 
-       Returns:
-           double: returns the distance between two positions.
-    """
-    return ((pos1[0] - pos2[0]) ** 2 + (pos1[1] - pos2[1]) ** 2) ** 0.5
+           Returns:
+               List of Tuple(double,Node): Sorted list of distances and nodes.
+        """
+        cx, cy = self.cell_of(pos)
+        reach = max(1, math.ceil(r / self.cell_size))
+        px, py = pos
+        r2 = r * r
+        found = []
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                for node in self.cells.get((i, j), ()):
+                    dx = node.pos[0] - px
+                    dy = node.pos[1] - py
+                    d2 = dx * dx + dy * dy
+                    if d2 <= r2:
+                        found.append((d2 ** 0.5, node))
+        found.sort()
+        return found
 
 
 ###########################################################
@@ -119,12 +1520,14 @@ class Node:
            id (int): Global unique ID of node.
            addr (Addr): Network address of node.
            ch_addr (Addr): Cluster Head network address
+           accepted_addrs (frozenset of Addr): Destination addresses accepted by node. It is rebuilt when addr or
+            ch_addr is assigned.
            is_sleep (bool): If it is True, It means node is sleeping and can not receive messages.
            Otherwise, node is awaken.
            logging (bool): It is a flag for logging. If it is True, nodes outputs can be seen in terminal.
-           active_timer_list (List of strings): It keeps the names of active timers.
-           neighbor_distance_list (List of Tuple(double,int)): Sorted list of nodes distances to other nodes.
-            Each Tuple keeps a distance and a node id.
+           timers (Dict): It keeps pending Timer handles by name. Handles of a name are kept in insertion order.
+           neighbor_distance_list (List of Tuple(double,Node)): Sorted list of distances to the nodes within
+            link range of the simulator. It is built from the sparse adjacency of the simulator when it is read.
            timeout (Function): timeout function
 
     """
@@ -142,15 +1545,16 @@ class Node:
                Node: Created node object.
         """
         self.pos = pos
-        self.tx_range = 0
+        self._tx_range = 0
         self.sim = sim
         self.id = id
+        self._addr = None
+        self._ch_addr = None
+        self.accepted_addrs = frozenset((BROADCAST_ADDR,))
         self.addr = Addr(0, id)
-        self.ch_addr = None
         self.is_sleep = False
         self.logging = True
-        self.active_timer_list = []
-        self.neighbor_distance_list = []
+        self.timers = {}
         self.timeout = self.sim.timeout
 
     ############################
@@ -164,6 +1568,122 @@ class Node:
         """
         return '<Node %d:(%.2f,%.2f)>' % (self.id, self.pos[0], self.pos[1])
 
+    ############################
+    def __lt__(self, obj):
+        """Orders nodes by id. It is used to break distance ties in neighbor lists.
+
+           Args:
+               obj (Node): Node to compare.
+
+           Returns:
+               bool: returns True if id of node is less than id of obj.
+        """
+        return self.id < obj.id
+
+    ############################
+    @property
+    def tx_range(self):
+        """Property for transmission range of node.
+
+           Args:
+
+           Returns:
+               double: Transmission range.
+        """
+        return self._tx_range
+
+    ############################
+    @tx_range.setter
+    def tx_range(self, value):
+        """Sets transmission range. Neighbor lists are rebuilt if it exceeds the link range of the simulator.
+
+           Args:
+               value (double): Transmission range.
+
+           Returns:
+
+        """
+        self._tx_range = value
+        if value > self.sim.link_range:
+            self.sim.topology_dirty = True
+
+    ############################
+    @property
+    def addr(self):
+        """Network address of node.
+
+           Args:
+
+           Returns:
+               Addr: Network address of node.
+        """
+        return self._addr
+
+    ############################
+    @addr.setter
+    def addr(self, value):
+        """Sets network address of node and rebuilds accepted addresses.
+
+           Args:
+               value (Addr): New network address.
+
+           Returns:
+
+        """
+        self._addr = value
+        self.update_accepted_addrs()
+
+    ############################
+    @property
+    def ch_addr(self):
+        """Cluster head network address of node.
+
+           Args:
+
+           Returns:
+               Addr: Cluster head network address of node.
+        """
+        return self._ch_addr
+
+    ############################
+    @ch_addr.setter
+    def ch_addr(self, value):
+        """Sets cluster head network address of node and rebuilds accepted addresses.
+
+           Args:
+               value (Addr): New cluster head network address.
+
+           Returns:
+
+        """
+        self._ch_addr = value
+        self.update_accepted_addrs()
+
+    ############################
+    @property
+    def active_timer_list(self):
+        """Property for names of pending timers.
+
+           Args:
+
+           Returns:
+               List of strings: Names of pending timers, a name appears once for each pending timer.
+        """
+        return [name for name, pending in self.timers.items() for _ in pending]
+
+    ############################
+    @property
+    def neighbor_distance_list(self):
+        """Property for neighbors of node sorted by distance.
+
+           Args:
+
+           Returns:
+               List of Tuple(double,Node): Sorted list of distances and nodes within link range.
+        """
+        ids, dists = self.sim.adjacency(self.id)
+        return list(zip(dists.tolist(), [self.sim.nodes[j] for j in ids.tolist()]))
+
     ############################
     @property
     def now(self):
@@ -178,7 +1698,7 @@ class Node:
 
     ############################
     def log(self, msg):
-        """Writes outputs of node to terminal.
+        """Writes outputs of node to terminal, stamped with elapsed time of simulator.
 
            Args:
                 msg (string): Output text
@@ -186,53 +1706,96 @@ class Node:
 
         """
         if self.logging:
-            print(f"Node {'#' + str(self.id):4}[{self.now:10.5f}] {msg}")
+            print(f"Node {'#' + str(self.id):4}[{self.sim.elapsed:10.5f}] {msg}")
 
     ############################
     def can_receive(self, pck):
-        """Checks if the given package is proper to receive.
+        """Checks if the given package is proper to receive. Broadcast address, node's address, cluster head address and
+        local broadcast addresses of their networks are accepted.
 
            Args:
-               pck (Dict): A package to check.
+               pck (Packet): A package to check.
 
            Returns:
                bool: returns True if the given package is proper to receive .
         """
-        dest = pck['next_hop'] if 'next_hop' in pck.keys() else pck['dest']
-        if dest.is_equal(BROADCAST_ADDR):  # if destination address is broadcast address
-            return True
-        if self.addr is not None:  # if node's address is assigned
-            if dest.is_equal(self.addr):  # if destination address is node's address
-                return True
-            elif dest.node_addr == config.BROADCAST_NODE_ADDR and dest.net_addr == self.addr.net_addr:  # if destination address is local broadcast address of node's network
-                return True
-        if self.ch_addr is not None:  # if node's cluster head address is assigned
-            if dest.is_equal(self.ch_addr):  # if destination address is node's cluster head address
-                return True
-            elif dest.node_addr == config.BROADCAST_NODE_ADDR and dest.net_addr == self.ch_addr.net_addr:  # if destination address is local broadcast address of node's cluster head network
-                return True
-        return False
+        dest = pck['next_hop'] if 'next_hop' in pck else pck['dest']
+        return dest in self.accepted_addrs
+
+    ############################
+    def update_accepted_addrs(self):
+        """Rebuilds the set of destination addresses accepted by node from addr and ch_addr.
+
+           Args:
+
+           Returns:
+
+        """
+        accepted = {BROADCAST_ADDR}
+        for addr in (self._addr, self._ch_addr):
+            if addr is not None:
+                accepted.add(addr)
+                accepted.add(addr.local_broadcast())
+        accepted = frozenset(accepted)
+        self.sim.update_addr_index(self, self.accepted_addrs, accepted)
+        self.accepted_addrs = accepted
 
     ############################
     def send(self, pck):
         """Sends given package. If dest address in pck is broadcast address, it sends the package to all neighbors.
+        Otherwise, receivers are looked up from address index of simulator and the ones within tx range get the package.
+        Sending is a TX burst and each delivery to an awake node is an RX burst for the radio energy accountant.
+        If batch broadcast is active in simulator, all receivers get the package in one event.
+        The package is not copied for each receiver, every receiver gets a view sharing its fields.
 
            Args:
-                pck (Dict): Package to be sent. It should contain 'dest' which is destination address.
+                pck (Dict or Packet): Package to be sent. It should contain 'dest' which is destination address.
            Returns:
 
         """
-        for (dist, node) in self.neighbor_distance_list:
-            if dist <= self.tx_range:
-                if node.can_receive(pck):
-                    prop_time = dist / 1000000 - 0.00001 if dist / 1000000 - 0.00001 >0 else 0.00001
-                    self.delayed_exec(prop_time, node.on_receive_check, pck)
+        pck = as_packet(pck).frozen()
+        sim = self.sim
+        if sim.radio is not None:
+            sim.radio.burst(self.id, RADIO_TX, sim.radio.size_of(pck), sim.env.now)
+        nodes = sim.nodes
+        tx_range = self._tx_range
+        batch = sim.batch_broadcast
+        receivers = []
+        prop_time = 0
+        dest = pck['next_hop'] if 'next_hop' in pck else pck['dest']
+        if dest == BROADCAST_ADDR:
+            # every neighbor within tx range receives, links of a node are sorted by distance
+            ids, dists = sim.adjacency(self.id)
+            end = np.searchsorted(dists, tx_range, side='right')
+            links = zip(dists[:end].tolist(), ids[:end].tolist())
+        else:
+            # only nodes accepting the destination can receive, they are looked up instead of filtering neighbors
+            links = []
+            x, y = self.pos
+            for node in sim.addr_index.get(dest, ()):
+                if node is not self:
+                    dx = x - node.pos[0]
+                    dy = y - node.pos[1]
+                    dist = math.sqrt(dx * dx + dy * dy)
+                    if dist <= tx_range:
+                        links.append((dist, node.id))
+            links.sort()
+        for (dist, id) in links:
+            node = nodes[id]
+            prop_time = dist / 1000000 - 0.00001 if dist / 1000000 - 0.00001 >0 else 0.00001
+            if batch:
+                receivers.append(node)
+            elif sim.direct_dispatch:
+                sim.schedule(prop_time + 0.00001, PRIORITY_RECEIVE, node.deliver, pck.view())
             else:
-                break
+                self.delayed_exec(prop_time, node.on_receive_check, pck.view())
+        if receivers:
+            # one event at the arrival time of the farthest receiver, receivers are in distance order
+            sim.schedule(prop_time + 0.00001, PRIORITY_RECEIVE, deliver_to_all, receivers, pck)
 
     ############################
     def set_timer(self, name, time, *args, **kwargs):
-        """Sets a timer with a given name. It appends name of timer to the active timer list.
+        """Sets a timer with a given name. Setting a name again does not affect the timers already pending with that name.
 
            Args:
                 name (string): Name of timer.
@@ -240,22 +1803,31 @@ class Node:
                 *args (string): Additional args.
                 **kwargs (string): Additional key word args.
            Returns:
-
+                Timer: Handle of timer. It can be cancelled by its cancel() method.
         """
-        self.active_timer_list.append(name)
-        self.delayed_exec(time - 0.00001, self.on_timer_fired_check, name, *args, **kwargs)
+        timer = Timer(self, name, args, kwargs)
+        self.timers.setdefault(name, {})[timer] = None
+        if self.sim.direct_dispatch:
+            self.sim.schedule(time, PRIORITY_TIMER, self.fire_timer, timer)
+        else:
+            self.sim.call_later(time - 0.00001, self.on_timer_fired_check, timer)
+        return timer
 
     ############################
     def kill_timer(self, name):
-        """Kills a timer with a given name. It removes name of timer from the active timer list if exists.
+        """Kills timers with a given name or a given Timer handle.
 
            Args:
-                name (string): Name of timer.
+                name (string or Timer): Name of timers, all pending timers with this name are killed. If it is a
+                 Timer handle, only that timer is killed.
            Returns:
 
         """
-        if name in self.active_timer_list:
-            self.active_timer_list.remove(name)
+        if isinstance(name, Timer):
+            name.cancel()
+            return
+        for timer in self.timers.pop(name, ()):
+            timer.cancelled = True
 
     ############################
     def kill_all_timers(self):
@@ -266,7 +1838,10 @@ class Node:
            Returns:
 
         """
-        self.active_timer_list = []
+        for pending in self.timers.values():
+            for timer in pending:
+                timer.cancelled = True
+        self.timers = {}
 
     ############################
     def delayed_exec(self, delay, func, *args, **kwargs):
@@ -323,7 +1898,7 @@ class Node:
         """It is executed when node receives a package. It should be overridden if needed.
 
            Args:
-                pck (Dict): Package received
+                pck (Packet): Package received
            Returns:
 
         """
@@ -335,13 +1910,32 @@ class Node:
         If sleeping, does not call on_recieve() and does not receive package.
 
            Args:
-                pck (Dict): Incoming package
+                pck (Packet): Incoming package
            Returns:
 
         """
         if not self.is_sleep:
+            if self.sim.radio is not None:
+                self.sim.radio.burst(self.id, RADIO_RX, self.sim.radio.size_of(pck), self.now)
             self.delayed_exec(0.00001, self.on_receive, pck)
 
+    ############################
+    def deliver(self, pck):
+        """Delivers an incoming package in a single event when direct dispatch is active.
+        If node is sleeping, does not call on_receive() and does not receive package.
+
+           Args:
+                pck (Packet): Incoming package
+           Returns:
+
+        """
+        if not self.is_sleep:
+            if self.sim.radio is not None:
+                self.sim.radio.burst(self.id, RADIO_RX, self.sim.radio.size_of(pck), self.now)
+            result = self.on_receive(pck)
+            if inspect.isgenerator(result):
+                self.sim.env.process(result)
+
     ############################
     def on_timer_fired(self, name, *args, **kwargs):
         """It is executed when a timer fired. It should be overridden if needed.
@@ -356,19 +1950,33 @@ class Node:
         pass
 
     ############################
-    def on_timer_fired_check(self, name, *args, **kwargs):
-        """Checks if the timer about to fire is in active timer list or not. If not, does not call on_timer_fired().
+    def on_timer_fired_check(self, timer):
+        """Checks if the timer about to fire is cancelled or not. If it is cancelled, does not call on_timer_fired().
 
            Args:
-                name (string): Name of timer.
-                *args (string): Additional args.
-                **kwargs (string): Additional key word args.
+                timer (Timer): Handle of timer.
+           Returns:
+
+        """
+        if not timer.cancelled:
+            timer.cancel()
+            self.delayed_exec(0.00001, self.on_timer_fired, timer.name, *timer.args, **timer.kwargs)
+
+    ############################
+    def fire_timer(self, timer):
+        """Fires a timer in a single event when direct dispatch is active. If it is cancelled, does not call
+        on_timer_fired().
+
+           Args:
+                timer (Timer): Handle of timer.
            Returns:
 
         """
-        if name in self.active_timer_list:
-            self.active_timer_list.remove(name)
-            self.delayed_exec(0.00001, self.on_timer_fired, name, *args, **kwargs)
+        if not timer.cancelled:
+            timer.cancel()
+            result = self.on_timer_fired(timer.name, *timer.args, **timer.kwargs)
+            if inspect.isgenerator(result):
+                self.sim.env.process(result)
 
     ############################
     def sleep(self):
@@ -380,6 +1988,8 @@ class Node:
 
         """
         self.is_sleep = True
+        if self.sim.radio is not None:
+            self.sim.radio.transition(self.id, RADIO_SLEEP, self.now)
 
     ############################
     def wake_up(self):
@@ -391,6 +2001,8 @@ class Node:
 
         """
         self.is_sleep = False
+        if self.sim.radio is not None:
+            self.sim.radio.transition(self.id, RADIO_IDLE, self.now)
 
     ############################
     def finish(self):
@@ -409,11 +2021,33 @@ class Simulator:
     """Class to model a network.
 
        Attributes:
-           timescale (double): Seconds in real time for 1 second in simulation. It arranges speed of simulation
+           timescale (double): Seconds in real time for 1 second in simulation. It arranges speed of simulation.
+            If it is 0 or less, simulation runs headless as fast as possible.
            nodes (List of Node): Nodes in network.
            duration (double): Duration of simulation.
            random (Random): Random object to use.
            timeout (Function): Timeout Function.
+           heap_core (bool): If it is True, events run on HeapEnvironment instead of simpy.
+           grid (SpatialGrid): Spatial index of nodes. It is created on the first range query.
+           link_range (double): Radius covered by adjacency. It is the max transmission range of nodes.
+           topology_dirty (bool): If it is True, adjacency is rebuilt before it is used.
+           adj_offsets (ndarray): Compressed sparse row offsets. Links of node i are in [adj_offsets[i], adj_offsets[i+1]).
+           adj_neighbors (ndarray): Neighbor ids of links, sorted by distance within each row.
+           adj_distances (ndarray): Distances of links.
+           direct_dispatch (bool): If it is True, packets and timers are dispatched to on_receive() and
+            on_timer_fired() in one event ordered by priorities. Otherwise, a check event is scheduled first.
+           batch_broadcast (bool): If it is True, a package is delivered to all of its receivers in one event at the
+            arrival time of the farthest receiver. Otherwise, one event is scheduled per receiver.
+           addr_index (Dict): Keeps the set of nodes accepting each address except broadcast address. Node addresses,
+            cluster head addresses and local broadcast addresses of their networks are kept.
+           role_index (Dict): Keeps the set of nodes in each role. It is maintained by node classes having roles.
+           radio (RadioEnergy): Energy accountant which nodes report radio states to. If it is None, radio energy
+            is not accounted.
+           lifetime (LifetimeMonitor): Network lifetime metrics which nodes report deaths to. It may stop the
+            simulation before its duration. If it is None, lifetime is not monitored.
+           fast_forward (FastForward): Skips steady state energy drain. If it is None, everything is simulated.
+           role_changes (int): Number of role changes reported to role index.
+           fast_forwarded (double): Seconds of steady state skipped analytically by FastForward.
 
     """
 
@@ -423,18 +2057,45 @@ class Simulator:
 
            Args:
                until (double): Duration of simulation.
-               timescale (double): Seconds in real time for 1 second in simulation. It arranges speed of simulation
+               timescale (double): Seconds in real time for 1 second in simulation. It arranges speed of simulation.
+                If it is 0 or less, a plain event environment without wall-clock pacing is used. It is a simpy
+                Environment or a HeapEnvironment on a heap or calendar queue as selected by config.SIM_EVENT_BACKEND.
                seed (double): seed for Random bbject.
 
            Returns:
                Simulator: Created Simulator object.
         """
-        self.env = simpy.rt.RealtimeEnvironment(factor=timescale, strict=False)
+        if timescale > 0:
+            self.env = simpy.rt.RealtimeEnvironment(factor=timescale, strict=False)
+        elif config.SIM_EVENT_BACKEND == 'heap':
+            self.env = HeapEnvironment()
+        elif config.SIM_EVENT_BACKEND == 'calendar':
+            self.env = HeapEnvironment(queue=CalendarQueue(config.SIM_CALENDAR_DAY_LENGTH, config.SIM_CALENDAR_DAYS))
+        elif config.SIM_EVENT_BACKEND == 'simpy':
+            self.env = simpy.Environment()
+        else:
+            raise ValueError(f'unknown event backend {config.SIM_EVENT_BACKEND!r}')
+        self.heap_core = type(self.env) is HeapEnvironment
         self.nodes = []
         self.duration = duration
         self.timescale = timescale
         self.random = random.Random(seed)
         self.timeout = self.env.timeout
+        self.grid = None
+        self.link_range = 0
+        self.topology_dirty = True
+        self.adj_offsets = np.zeros(1, dtype=np.int64)
+        self.adj_neighbors = np.empty(0, dtype=np.int64)
+        self.adj_distances = np.empty(0)
+        self.direct_dispatch = config.SIM_DIRECT_DISPATCH
+        self.batch_broadcast = config.SIM_BATCH_BROADCAST
+        self.addr_index = {}
+        self.role_index = {}
+        self.radio = None
+        self.lifetime = None
+        self.fast_forward = None
+        self.role_changes = 0
+        self.fast_forwarded = 0.0
 
     ############################
     @property
@@ -448,9 +2109,22 @@ class Simulator:
         """
         return self.env.now
 
+    ############################
+    @property
+    def elapsed(self):
+        """Property for time of simulation including the steady state skipped by fast forward.
+
+           Args:
+
+           Returns:
+               double: Elapsed time.
+        """
+        return self.env.now + self.fast_forwarded
+
     ############################
     def delayed_exec(self, delay, func, *args, **kwargs):
         """Executes a function with given parameters after a given delay.
+        Plain functions are scheduled directly as callbacks, generator functions are started as simpy processes.
 
            Args:
                 delay (double): Delay duration.
@@ -458,10 +2132,47 @@ class Simulator:
                 *args (double): Function args.
                 delay (double): Function key word args.
            Returns:
+                Event: Scheduled event.
+        """
+        if inspect.isgeneratorfunction(func):
+            func = ensure_generator(self.env, func, *args, **kwargs)
+            return start_delayed(self.env, func, delay=delay)
+        return self.call_later(delay, func, *args, **kwargs)
+
+    ############################
+    def call_later(self, delay, func, *args, **kwargs):
+        """Calls a plain function with given parameters after a given delay.
+        It only schedules one event, no generator or process is created.
+
+           Args:
+                delay (double): Delay duration.
+                func (Function): Function to call. It must not be a generator function.
+                *args (double): Function args.
+                **kwargs (double): Function key word args.
+           Returns:
+                Event: Scheduled event. None on heap core, calls are not events there.
+        """
+        if self.heap_core:
+            return self.env.call(delay, PRIORITY_NORMAL, func, args, kwargs)
+        return ScheduledCall(self.env, delay, PRIORITY_NORMAL, func, args, kwargs)
+
+    ############################
+    def schedule(self, delay, priority, func, *args, **kwargs):
+        """Calls a plain function with given parameters after a given delay with a given priority.
+        Events at the same time are processed in increasing priority order, then in scheduling order.
 
+           Args:
+                delay (double): Delay duration.
+                priority (int): Priority of event. One of PRIORITY_* constants.
+                func (Function): Function to call. It must not be a generator function.
+                *args (double): Function args.
+                **kwargs (double): Function key word args.
+           Returns:
+                Event: Scheduled event. None on heap core, calls are not events there.
         """
-        func = ensure_generator(self.env, func, *args, **kwargs)
-        start_delayed(self.env, func, delay=delay)
+        if self.heap_core:
+            return self.env.call(delay, priority, func, args, kwargs)
+        return ScheduledCall(self.env, delay, priority, func, args, kwargs)
 
     ############################
     def add_node(self, node_class, pos):
@@ -479,41 +2190,178 @@ class Simulator:
         self.update_neighbor_list(id)
         return node
 
+    ############################
+    def add_nodes(self, node_class, positions, tx_range=None):
+        """Adds many nodes in to network at once. Adjacency of all nodes is built in one pass
+        from in-range pairs which are computed with NumPy.
+
+           Args:
+                node_class (Class): Node class inherited from Node.
+                positions (List of Tuple(double,double) or ndarray): Positions of nodes.
+                tx_range (double): Transmission range of created nodes. If it is None, it stays as the default.
+           Returns:
+                List of nodeclass object: Created nodeclass objects
+        """
+        first = len(self.nodes)
+        nodes = [node_class(self, first + i, (x, y))
+                 for i, (x, y) in enumerate(np.asarray(positions, dtype=float).reshape(-1, 2).tolist())]
+        self.nodes.extend(nodes)
+        if tx_range is not None:
+            for node in nodes:
+                node.tx_range = tx_range
+        if self.grid is not None:
+            for node in nodes:
+                self.grid.add(node)
+        self.topology_dirty = True
+        self.update_topology()
+        return nodes
+
+    ############################
+    def get_node(self, id):
+        """Gives the node with given id. Ids are indexes in nodes list, so it does not search.
+
+           Args:
+                id (int): Global unique id of node. NumPy integers are accepted.
+           Returns:
+                Node: Node with given id. None if there is no such node.
+        """
+        try:
+            id = operator.index(id)
+        except TypeError:
+            return None
+        if 0 <= id < len(self.nodes):
+            return self.nodes[id]
+        return None
+
+    ############################
+    def update_role_index(self, node, old_role, new_role):
+        """Moves a node between role index entries after its role changes. Roles are defined by node classes,
+        so they call it when they switch roles.
+
+           Args:
+                node (Node): Node whose role changed.
+                old_role (Any): Previous role. None if node had no role.
+                new_role (Any): New role.
+           Returns:
+
+        """
+        self.role_changes += 1
+        index = self.role_index
+        if old_role is not None and old_role in index:
+            index[old_role].discard(node)
+        if new_role is not None:
+            index.setdefault(new_role, set()).add(node)
+
+    ############################
+    def nodes_with_role(self, *roles):
+        """Gives the nodes with any of given roles from role index.
+
+           Args:
+                *roles (Any): Roles to look up.
+           Returns:
+                List of Node: Nodes sorted by id, in the same order as nodes list.
+        """
+        index = self.role_index
+        return sorted(node for role in roles for node in index.get(role, ()))
+
+    ############################
+    def nodes_in_range(self, pos, r):
+        """Finds nodes within a given distance of a position by using the spatial grid. The grid is built on the
+        first call and kept up to date incrementally afterwards.
+
+           Args:
+                pos (Tuple(double,double)): Center position.
+                r (double): Radius.
+           Returns:
+                List of Tuple(double,Node): Sorted list of distances and nodes.
+        """
+        if self.grid is None:
+            self.grid = SpatialGrid(self.link_range or config.NODE_TX_RANGE, self.nodes)
+        return self.grid.nodes_within(pos, r)
+
+    ############################
+    def update_topology(self):
+        """Rebuilds the sparse adjacency of all nodes. Link range becomes the max transmission range of nodes.
+        In-range pairs are found with a vectorised grid join and kept in compressed sparse row form, so memory
+        grows with the number of links. The spatial grid is not rebuilt, it is maintained incrementally.
+
+           Args:
+
+           Returns:
+
+        """
+        nodes = self.nodes
+        self.link_range = max((n.tx_range for n in nodes), default=0)
+        src, dst, dist = in_range_pairs([n.pos for n in nodes], self.link_range)
+        self.adj_offsets = np.searchsorted(src, np.arange(len(nodes) + 1))
+        self.adj_neighbors = dst
+        self.adj_distances = dist
+        self.topology_dirty = False
+
+    ############################
+    def adjacency(self, id):
+        """Gives the links of a node from the sparse adjacency. It is rebuilt first if topology is changed.
+
+           Args:
+                id (int): Global unique id of node
+           Returns:
+                Tuple(ndarray,ndarray): Neighbor ids and distances sorted by distance.
+        """
+        if self.topology_dirty:
+            self.update_topology()
+        start, end = self.adj_offsets[id], self.adj_offsets[id + 1]
+        return self.adj_neighbors[start:end], self.adj_distances[start:end]
+
+    ############################
+    def update_addr_index(self, node, old_addrs, new_addrs):
+        """Moves a node between address index entries after its accepted addresses change.
+
+           Args:
+                node (Node): Node whose addresses changed.
+                old_addrs (frozenset of Addr): Addresses accepted before.
+                new_addrs (frozenset of Addr): Addresses accepted now.
+           Returns:
+
+        """
+        index = self.addr_index
+        for addr in old_addrs - new_addrs:
+            group = index.get(addr)
+            if group is not None:
+                group.discard(node)
+                if not group:
+                    del index[addr]
+        for addr in new_addrs - old_addrs:
+            if addr is not BROADCAST_ADDR:
+                index.setdefault(addr, set()).add(node)
+
     ############################
     def update_neighbor_list(self, id):
         '''
-        Maintain each node's neighbor list by sorted distance after affected
-        by addition or relocation of node with ID id
+        Maintain spatial grid after affected by addition or relocation of node with ID id.
+        Adjacency is marked to be rebuilt, so many changes at the same time cost one vectorised rebuild.
 
         Args:
             id (int): Global unique id of node
         Returns:
 
         '''
-        me = self.nodes[id]
+        if self.grid is not None:
+            self.grid.update(self.nodes[id])
+        self.topology_dirty = True
 
-        # (re)sort other nodes' neighbor lists by distance
-        for n in self.nodes:
-            # skip this node
-            if n is me:
-                continue
-
-            nlist = n.neighbor_distance_list
+    ############################
+    def stop(self):
+        """Stops the simulation after the events at the current time which are already scheduled.
+        Finish functions of nodes are still called.
 
-            # remove this node from other nodes' neighbor lists
-            for i, (dist, neighbor) in enumerate(nlist):
-                if neighbor is me:
-                    del nlist[i]
-                    break
+           Args:
 
-            # then insert it while maintaining sort order by distance
-            bisect.insort(nlist, (distance(n.pos, me.pos), me))
+           Returns:
 
-        self.nodes[id].neighbor_distance_list = [
-            (distance(n.pos, me.pos), n)
-            for n in self.nodes if n is not me
-        ]
-        self.nodes[id].neighbor_distance_list.sort()
+        """
+        event = self.env.event()
+        event.callbacks.append(simpy.core.StopSimulation.callback)
+        event.succeed()
 
     ############################
     def run(self):
@@ -525,6 +2373,8 @@ class Simulator:
            Returns:
 
         """
+        if self.topology_dirty:
+            self.update_topology()
         for n in self.nodes:
             n.init()
         for n in self.nodes:
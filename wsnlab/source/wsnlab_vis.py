@@ -36,7 +36,7 @@ class Node(wsnlab.Node):
         """Visualise sending process in addition to base send method.
 
            Args:
-               pck (Dict): Package to be sent.
+               pck (Dict or Packet): Package to be sent.
 
            Returns:
 
@@ -143,6 +143,7 @@ class Simulator(wsnlab.Simulator):
            Args:
                duration (double): Duration of simulation.
                timescale (double): Seconds in real time for 1 second in simulation. It arranges speed of simulation
+                It is ignored when visual is False, headless runs are executed as fast as possible.
                seed (double): seed for Random bbject.
                terrain_size (Tuple(double,double)): Size of visualised terrain.
                visual (bool): A flag to visualising process.
@@ -151,6 +152,8 @@ class Simulator(wsnlab.Simulator):
            Returns:
                Simulator: Created Simulator object.
         """
+        if not visual:
+            timescale = 0  # nothing to watch, no need for wall-clock pacing
         super().__init__(duration, timescale, seed)
         self.visual = visual
         self.terrain_size = terrain_size